@@ -5,17 +5,80 @@ from __future__ import unicode_literals
 
 import base64
 import binascii
+import threading
+import time
+from collections import OrderedDict
 
+from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.middleware.csrf import CsrfViewMiddleware
 from django.utils.six import text_type
 from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import HTTP_HEADER_ENCODING, exceptions
 from rest_framework.authentication import TokenAuthentication as DefaultTokenAuthentication
+from rest_framework.authtoken.models import Token
 
 from django.contrib.auth import get_user_model
 
+
+class TokenUserCache(object):
+    """
+    Process local LRU cache of token key -> (user, token) with a TTL.
+    
+    Entries are dropped when the Token or its User changes (see signals below), 
+    the TTL bounds how stale other processes can be.
+    """
+    
+    def __init__(self, timeout, max_size):
+        self.timeout = timeout
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            
+            expires_at, credentials = entry
+            if expires_at < time.time():
+                return None
+            
+            #most recently used entries live at the end
+            self._entries[key] = entry
+            return credentials
+        
+    def set(self, key, credentials):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.timeout, credentials)
+            
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            
+    def delete_user(self, user_id):
+        with self._lock:
+            for key, (expires_at, (user, token)) in self._entries.items():
+                if user.id == user_id:
+                    del self._entries[key]
+                    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_user_cache = TokenUserCache(settings.TOKEN_AUTHENTICATION_CACHE_TIMEOUT,
+                                  settings.TOKEN_AUTHENTICATION_CACHE_MAX_SIZE)
+
+
 class TokenAuthentication(DefaultTokenAuthentication):
    
 
@@ -26,6 +89,29 @@ class TokenAuthentication(DefaultTokenAuthentication):
        
 
         return super(TokenAuthentication,self).authenticate(request, *args, **kwargs)
+    
+    def authenticate_credentials(self, key):
+        
+        credentials = token_user_cache.get(key)
+        
+        #invalid or inactive tokens raise and are never cached
+        if credentials is None:
+            credentials = super(TokenAuthentication,self).authenticate_credentials(key)
+            token_user_cache.set(key, credentials)
+            
+        return credentials
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def clear_token_user_cache(sender, instance, **kwargs):
+    token_user_cache.delete(instance.key)
+    
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def clear_user_token_user_cache(sender, instance, **kwargs):
+    #e.g. users that have been deactivated
+    token_user_cache.delete_user(instance.id)
 
     
 class EmailBackend(object):
@@ -1,7 +1,11 @@
+from collections import defaultdict
+from decimal import Decimal
+
 from django.db import transaction
 from django.utils import timezone
 from autolims.models import (Instruction, Aliquot,Container,
-                             AliquotEffect, Resource)
+                             AliquotEffect, Resource, ContainerSummary,
+                             ContainerSnapshot, AliquotLineageEdge)
 
 from transcriptic_tools.inventory import get_transcriptic_inventory
 from transcriptic_tools.enums import Reagent
@@ -25,17 +29,43 @@ def get_or_create_aliquot_from_path(run_id, aliquot_path):
     
     assert isinstance(container,Container)
     
-    #check if the aliquot exists
-    
-    aliquot_query = container.aliquots.filter(well_idx = well_idx )
+    return Aliquot.get_or_create_by_well_idx(container.id, well_idx)
     
-    if aliquot_query.exists():
-        return aliquot_query.first()
+
+class AliquotVolumeDeltas(object):
+    """
+    Collects the volume changes an instruction makes per aliquot so they can be written 
+    atomically in the db with one UPDATE per distinct delta (see Aliquot.add_volumes)
+    rather than a read-modify-write save of every aliquot.
     
-    return Aliquot.objects.create(well_idx = well_idx,
-                           container = container,
-                           volume_ul='0')
+    Container summaries are updated from the same deltas.
+    """
     
+    def __init__(self):
+        self.deltas_ul = defaultdict(Decimal)
+        self.container_deltas_ul = defaultdict(Decimal)
+        
+    def add(self, aliquot, volume):
+        """
+        Returns the added volume as a Decimal of microliters
+        """
+        delta_ul = Aliquot.get_volume_delta_ul(volume)
+        self.deltas_ul[aliquot.id] += delta_ul
+        self.container_deltas_ul[aliquot.container_id] += delta_ul
+        return delta_ul
+    
+    def subtract(self, aliquot, volume):
+        delta_ul = Aliquot.get_volume_delta_ul(volume)
+        self.deltas_ul[aliquot.id] -= delta_ul
+        self.container_deltas_ul[aliquot.container_id] -= delta_ul
+        return delta_ul
+    
+    def save(self):
+        Aliquot.add_volumes(self.deltas_ul)
+        ContainerSummary.add_volumes(self.container_deltas_ul)
+        self.deltas_ul.clear()
+        self.container_deltas_ul.clear()
+
 
 # ------ Instruction Executers --------
 
@@ -49,7 +79,7 @@ def execute_oligosynthesize(instruction):
                                    'scale':oligo_info['scale'],
                                    'purification':oligo_info['purification']
                                    })
-        aliquot.save()
+        aliquot.save(update_fields=['properties','updated_at'])
         
         AliquotEffect.objects.create(aliquot = aliquot,
                                      instruction = instruction,
@@ -134,6 +164,10 @@ def execute_pipette(instruction):
     
     operation = instruction.operation
     
+    volume_deltas = AliquotVolumeDeltas()
+    
+    lineage_edges = []
+    
     for pipette_group in operation['groups']:
         
         
@@ -144,11 +178,13 @@ def execute_pipette(instruction):
             from_aq = get_or_create_aliquot_from_path(instruction.run, transfer_info['from_aq_path'])
             to_aq = get_or_create_aliquot_from_path(instruction.run, transfer_info['to_aq_path'])        
             
-            added_volume = to_aq.add_volume(transfer_info['volume_str'])
-            from_aq.subtract_volume(transfer_info['volume_str'])
-        
-            to_aq.save()
-            from_aq.save()
+            added_volume_ul = volume_deltas.add(to_aq, transfer_info['volume_str'])
+            volume_deltas.subtract(from_aq, transfer_info['volume_str'])
+            
+            lineage_edges.append(AliquotLineageEdge(source_aliquot = from_aq,
+                                                    destination_aliquot = to_aq,
+                                                    instruction = instruction,
+                                                    volume_ul = added_volume_ul))
         
             AliquotEffect.objects.create(aliquot = to_aq,
                                          instruction = instruction,
@@ -156,8 +192,9 @@ def execute_pipette(instruction):
                                              'container_id': from_aq.container_id,
                                              'well_idx': from_aq.well_idx
                                              },
-                                                 'volume_ul': str(added_volume.to('microliter').magnitude) 
-                                                 },                                             
+                                                 'volume_ul': str(added_volume_ul) 
+                                                 },
+                                         volume_delta_ul = added_volume_ul,
                                          type = 'liquid_transfer_in'
                                          )     
         
@@ -167,12 +204,15 @@ def execute_pipette(instruction):
                                              'container_id': to_aq.container_id,
                                              'well_idx': to_aq.well_idx
                                              },
-                                                 'volume_ul': str(added_volume.to('microliter').magnitude) 
+                                                 'volume_ul': str(added_volume_ul) 
                                                  },
+                                         volume_delta_ul = -added_volume_ul,
                                          type = 'liquid_transfer_out'
                                          )            
         
         
+    volume_deltas.save()
+    AliquotLineageEdge.objects.bulk_create(lineage_edges)
         
     mark_instruction_complete(instruction)
   
@@ -201,20 +241,25 @@ def execute_provision(instruction):
     else:
         resource = Resource.objects.get(id=resource_id)
     
+    volume_deltas = AliquotVolumeDeltas()
+    
     for destination_info in operation['to']:
         
         aliquot = get_or_create_aliquot_from_path(instruction.run, destination_info['well'])
         aliquot.properties.update({'resource_id':resource.id,
                                    'resource_name': resource.name
                                    })
-        aliquot.add_volume(destination_info['volume'])
-        aliquot.save()
+        added_volume_ul = volume_deltas.add(aliquot, destination_info['volume'])
+        aliquot.save(update_fields=['properties','updated_at'])
         
         AliquotEffect.objects.create(aliquot = aliquot,
                                      instruction = instruction,
+                                     volume_delta_ul = added_volume_ul,
                                      type = 'instructions'
                                     )
         
+    volume_deltas.save()
+        
     mark_instruction_complete(instruction)
 
 def execute_dispense(instruction):
@@ -234,28 +279,36 @@ def execute_dispense(instruction):
     else:
         resource = Resource.objects.get(id=resource_id)
     
+    volume_deltas = AliquotVolumeDeltas()
+    
+    #convert columns into well indexes
+    well_indexes_by_column = {column_info['column']: \
+                              destination_container.get_column_well_indexes(column_info['column'])
+                              for column_info in operation['columns']}
+    
+    aliquots_by_well_idx = Aliquot.get_or_create_many(destination_container.id,
+                                                      [well_idx for well_indexes in well_indexes_by_column.values()
+                                                       for well_idx in well_indexes])
+    
     for column_info in operation['columns']:
         
-        column_id = column_info['column']
-        
-        #convert columns into well indexes
-        well_indexes = destination_container.get_column_well_indexes(column_id)
+        for well_idx in well_indexes_by_column[column_info['column']]:
         
-        for well_idx in well_indexes:
-        
-            aliquot, created = Aliquot.objects.get_or_create(well_idx = well_idx,
-                                             container = destination_container)
+            aliquot = aliquots_by_well_idx[well_idx]
             aliquot.properties.update({'resource_id':resource.id,
                                        'resource_name': resource.name
                                        })
-            aliquot.add_volume(column_info['volume'])
-            aliquot.save()
+            added_volume_ul = volume_deltas.add(aliquot, column_info['volume'])
+            aliquot.save(update_fields=['properties','updated_at'])
             
             AliquotEffect.objects.create(aliquot = aliquot,
                                          instruction = instruction,
+                                         volume_delta_ul = added_volume_ul,
                                          type = 'instructions'
                                         )
         
+    volume_deltas.save()
+        
     mark_instruction_complete(instruction)
 
 def execute_stamp(instruction):
@@ -296,6 +349,9 @@ def execute_run(run):
     assert run.status in ['accepted','in_progress'],\
            'Run must be in accepted or in_progress state to execute. Currently %s'%run.status
     
+    #so the state before this run can be replayed from a recent snapshot
+    ContainerSnapshot.take_if_needed(run.run_containers.values_list('container_id', flat=True))
+    
     #sequence no asc
     ordered_instructions = run.instructions.all().order_by('sequence_no')
     
@@ -310,9 +366,14 @@ def execute_run(run):
     
     for container_label, out_info in run.protocol.get('outs',{}).items():
         
+        container = Container.get_container_from_run_and_container_label(run.id,
+                                                                          container_label)
+        
+        aliquots_by_well_idx = Aliquot.get_or_create_many(container.id,
+                                                          [int(well_idx_str) for well_idx_str in out_info.keys()])
+        
         for well_idx_str, well_info in out_info.items():
-            aq = get_or_create_aliquot_from_path(run.id, '%s/%s'%(container_label,
-                                                                  well_idx_str))
+            aq = aliquots_by_well_idx[int(well_idx_str)]
             
             updated = False
             if 'name' in well_info:
@@ -324,7 +385,7 @@ def execute_run(run):
                 aq.properties.update(well_info['properties'])
                 
             if updated:
-                aq.save()
+                aq.save(update_fields=['name','properties','updated_at'])
                 
                 
     
@@ -341,6 +402,8 @@ def execute_run(run):
             container.save()
     
     
+    ContainerSummary.mark_touched(run)
+    
     run.status = 'complete'
     run.completed_at = timezone.now()
     run.save()
\ No newline at end of file
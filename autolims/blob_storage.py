@@ -0,0 +1,310 @@
+"""
+File storage that keeps Data files and images on disk (or any mounted volume)
+instead of base64 in postgres.
+
+Files are split into chunks stored under the sha256 of their content so identical
+chunks are only stored once. Each file's content has a json manifest listing its chunks.
+Names are <sha256 of the content>/<filename>.
+
+Names in the db_file_storage format (files saved before this storage) are still
+read from the database until moved with `manage.py move_blobs_to_filesystem`
+"""
+
+import errno
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.core.urlresolvers import reverse
+from django.db.models import Q
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import force_text
+from db_file_storage.storage import DatabaseFileStorage, NameException
+
+#bytes read from disk at a time when streaming
+READ_SIZE = 64*1024
+
+
+class ChunkedBlobFile(object):
+    """
+    Read only, seekable file over the chunks of a manifest
+    """
+
+    def __init__(self, storage, manifest):
+        self.storage = storage
+        self.manifest = manifest
+        self.size = manifest['size']
+        self.position = 0
+
+        #(start offset, end offset, chunk hash)
+        self.chunk_ranges = []
+
+        start = 0
+        for chunk_hash, chunk_size in manifest['chunks']:
+            self.chunk_ranges.append((start, start + chunk_size, chunk_hash))
+            start += chunk_size
+
+    def iter_range(self, start, end):
+        """
+        Yields the bytes from start up to (not including) end
+        """
+
+        for chunk_start, chunk_end, chunk_hash in self.chunk_ranges:
+            if chunk_end <= start or chunk_start >= end:
+                continue
+
+            with open(self.storage.chunk_path(chunk_hash), 'rb') as chunk_file:
+                chunk_file.seek(max(start - chunk_start, 0))
+
+                remaining = min(end, chunk_end) - max(start, chunk_start)
+
+                while remaining > 0:
+                    data = chunk_file.read(min(READ_SIZE, remaining))
+                    if not data:
+                        raise IOError('Blob chunk %s is truncated'%chunk_hash)
+                    remaining -= len(data)
+                    yield data
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+
+        data = b''.join(self.iter_range(self.position, end))
+        self.position = end
+
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+
+        self.position = max(offset, 0)
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        pass
+
+
+@deconstructible
+class ChunkedFileStorage(Storage):
+
+    def __init__(self, location=None, chunk_size=None):
+        self.location = location or settings.BLOB_STORAGE_ROOT
+        self.chunk_size = chunk_size or settings.BLOB_STORAGE_CHUNK_SIZE
+        self.database_storage = DatabaseFileStorage()
+
+    def is_legacy_name(self, name):
+        """
+        Names of files still stored in the database by db_file_storage
+        """
+
+        return self.get_content_hash(name) is None
+
+    def get_content_hash(self, name):
+        content_hash, _, filename = force_text(name).partition('/')
+
+        if len(content_hash) != 64 or not filename or '/' in filename:
+            return None
+
+        try:
+            int(content_hash, 16)
+        except ValueError:
+            return None
+
+        return content_hash
+
+    def chunk_path(self, chunk_hash):
+        return os.path.join(self.location, 'chunks', chunk_hash[:2], chunk_hash)
+
+    def manifest_path(self, content_hash):
+        return os.path.join(self.location, 'manifests', content_hash[:2], '%s.json'%content_hash)
+
+    def derived_path(self, name, *parts):
+        """
+        Where files generated from a blob's content (e.g. thumbnails) are kept
+        """
+
+        content_hash = self.get_content_hash(name)
+
+        return os.path.join(self.location, 'derived', content_hash[:2], content_hash, *parts)
+
+    def write_atomic(self, path, data):
+        """
+        Writes to a temp file then renames so readers never see partial files
+        """
+
+        directory = os.path.dirname(path)
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            os.rename(temp_path, path)
+        except:
+            os.remove(temp_path)
+            raise
+
+    def get_manifest(self, name):
+        with open(self.manifest_path(self.get_content_hash(name))) as manifest_file:
+            return json.load(manifest_file)
+
+    def get_mimetype(self, name):
+        return self.get_manifest(name)['mimetype']
+
+    def get_available_name(self, name, max_length=None):
+        #names are derived from the content in _save, identical files share a name
+        return name
+
+    def _save(self, name, content):
+
+        content_hasher = hashlib.sha256()
+        chunks = []
+
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        for data in content.chunks(self.chunk_size):
+            if not data:
+                continue
+
+            content_hasher.update(data)
+
+            chunk_hash = hashlib.sha256(data).hexdigest()
+
+            if not os.path.exists(self.chunk_path(chunk_hash)):
+                self.write_atomic(self.chunk_path(chunk_hash), data)
+
+            chunks.append((chunk_hash, len(data)))
+
+        content_hash = content_hasher.hexdigest()
+
+        filename = os.path.basename(force_text(name).replace('\\', '/')) or 'file'
+
+        mimetype = getattr(content, 'mimetype', None) or \
+            getattr(getattr(content, 'file', None), 'content_type', None) or \
+            mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        if not os.path.exists(self.manifest_path(content_hash)):
+            self.write_atomic(self.manifest_path(content_hash),
+                              json.dumps({'size': sum(chunk_size for _, chunk_size in chunks),
+                                          'chunks': chunks,
+                                          'mimetype': mimetype}).encode('utf-8'))
+
+        return '%s/%s'%(content_hash, filename)
+
+    def _open(self, name, mode='rb'):
+        if self.is_legacy_name(name):
+            return self.database_storage.open(name, mode)
+
+        assert mode in ('r', 'rb'), 'Blobs are read only'
+
+        blob_file = File(ChunkedBlobFile(self, self.get_manifest(name)),
+                         name=name)
+        blob_file.mimetype = self.get_mimetype(name)
+
+        return blob_file
+
+    def open_blob(self, name):
+        """
+        The underlying ChunkedBlobFile, for streaming ranges
+        """
+
+        return ChunkedBlobFile(self, self.get_manifest(name))
+
+    def exists(self, name):
+        if self.is_legacy_name(name):
+            return self.database_storage.exists(name)
+
+        return os.path.exists(self.manifest_path(self.get_content_hash(name)))
+
+    def size(self, name):
+        if self.is_legacy_name(name):
+            return self.database_storage.size(name)
+
+        return self.get_manifest(name)['size']
+
+    def delete(self, name):
+        """
+        Removes the manifest for the name's content.
+        Chunks can be shared so they are removed by delete_unreferenced_chunks.
+        Use delete_blob_if_unreferenced to keep files other rows still use
+        """
+
+        if self.is_legacy_name(name):
+            try:
+                return self.database_storage.delete(name)
+            except NameException:
+                return
+
+        try:
+            os.remove(self.manifest_path(self.get_content_hash(name)))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def delete_unreferenced_chunks(self):
+        """
+        Removes chunks no manifest refers to. Returns the number removed
+        """
+
+        referenced_chunk_hashes = set()
+
+        for directory, _, filenames in os.walk(os.path.join(self.location, 'manifests')):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    with open(os.path.join(directory, filename)) as manifest_file:
+                        referenced_chunk_hashes.update(chunk_hash for chunk_hash, _ in
+                                                       json.load(manifest_file)['chunks'])
+
+        removed_count = 0
+
+        for directory, _, filenames in os.walk(os.path.join(self.location, 'chunks')):
+            for filename in filenames:
+                if len(filename) == 64 and filename not in referenced_chunk_hashes:
+                    os.remove(os.path.join(directory, filename))
+                    removed_count += 1
+
+        return removed_count
+
+    def url(self, name):
+        if self.is_legacy_name(name):
+            return self.database_storage.url(name)
+
+        return reverse('blob', kwargs={'name': name})
+
+
+def delete_blob_if_unreferenced(model_class, field_names, name):
+    """
+    Deletes the file unless a row of model_class still refers to its content
+    from any of field_names
+    """
+
+    storage = model_class._meta.get_field(field_names[0]).storage
+
+    content_hash = storage.get_content_hash(name) if hasattr(storage, 'get_content_hash') else None
+
+    if content_hash:
+        lookups = [Q(**{'%s__startswith'%field_name: '%s/'%content_hash})
+                   for field_name in field_names]
+    else:
+        lookups = [Q(**{field_name: name}) for field_name in field_names]
+
+    if not model_class.objects.filter(reduce(or_, lookups)).exists():
+        storage.delete(name)
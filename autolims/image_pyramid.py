@@ -0,0 +1,126 @@
+"""
+Thumbnails and zoom tiles for Data images so they can be browsed without
+transferring the full resolution originals.
+
+Generated files are kept next to the original in blob storage, keyed by the
+image's content hash:
+
+    thumbnail.jpg                   fits in THUMBNAIL_SIZE x THUMBNAIL_SIZE
+    tiles/<level>/<col>_<row>.jpg   level 0 is full resolution, each level halves it
+    info.json                       image and level dimensions, written last
+"""
+
+import io
+import json
+import logging
+import math
+import os
+import threading
+
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 85
+
+#content hashes being generated by this process
+_generating_hashes = set()
+_generating_lock = threading.Lock()
+
+
+def has_image_pyramid(storage, name):
+    return os.path.exists(storage.derived_path(name, 'info.json'))
+
+
+def _to_jpeg_mode(image):
+    
+    #16 bit grayscale (common for plate readers) is scaled down to 8 bit
+    if image.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+        return image.point(lambda value: value*(1./256)).convert('L')
+    
+    if image.mode not in ('RGB', 'L'):
+        return image.convert('RGB')
+    
+    return image
+
+
+def _encode_jpeg(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def generate_image_pyramid(storage, name):
+    """
+    Writes the thumbnail, tiles and info.json for a blob storage image
+    """
+    
+    tile_size = settings.IMAGE_TILE_SIZE
+    thumbnail_size = settings.IMAGE_THUMBNAIL_SIZE
+    
+    image = Image.open(storage.open(name))
+    image.load()
+    image = _to_jpeg_mode(image)
+    
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.ANTIALIAS)
+    storage.write_atomic(storage.derived_path(name, 'thumbnail.jpg'), _encode_jpeg(thumbnail))
+    
+    levels = []
+    level_image = image
+    
+    while True:
+        width, height = level_image.size
+        columns = int(math.ceil(width/float(tile_size)))
+        rows = int(math.ceil(height/float(tile_size)))
+        
+        for column in range(columns):
+            for row in range(rows):
+                tile = level_image.crop((column*tile_size, row*tile_size,
+                                         min((column + 1)*tile_size, width),
+                                         min((row + 1)*tile_size, height)))
+                storage.write_atomic(storage.derived_path(name, 'tiles', str(len(levels)),
+                                                          '%s_%s.jpg'%(column, row)),
+                                     _encode_jpeg(tile))
+        
+        levels.append({'level': len(levels), 'width': width, 'height': height,
+                       'columns': columns, 'rows': rows})
+        
+        if columns == 1 and rows == 1:
+            break
+        
+        level_image = level_image.resize((max(width//2, 1), max(height//2, 1)), Image.ANTIALIAS)
+        
+    storage.write_atomic(storage.derived_path(name, 'info.json'),
+                         json.dumps({'width': image.size[0],
+                                     'height': image.size[1],
+                                     'tile_size': tile_size,
+                                     'levels': levels}).encode('utf-8'))
+
+
+def generate_image_pyramid_in_background(storage, name):
+    """
+    Generates in a daemon thread, once per image at a time in this process
+    """
+    
+    content_hash = storage.get_content_hash(name)
+    
+    with _generating_lock:
+        if content_hash in _generating_hashes:
+            return
+        _generating_hashes.add(content_hash)
+        
+    def generate():
+        try:
+            if not has_image_pyramid(storage, name):
+                generate_image_pyramid(storage, name)
+        except Exception:
+            logger.exception('Generating thumbnails and tiles for %s failed', name)
+        finally:
+            with _generating_lock:
+                _generating_hashes.discard(content_hash)
+                
+    thread = threading.Thread(target=generate, name='image-pyramid-%s'%content_hash[:8])
+    thread.daemon = True
+    thread.start()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from autolims.models import Data
+from autolims.image_pyramid import has_image_pyramid, generate_image_pyramid
+
+
+class Command(BaseCommand):
+    help = 'Generates missing thumbnails and zoom tiles for Data images in blob storage'
+    
+    def handle(self, *args, **options):
+        
+        storage = Data._meta.get_field('image').storage
+        
+        generated_count = 0
+        
+        for name in Data.objects.exclude(image='').exclude(image__isnull=True)\
+            .values_list('image', flat=True).distinct().iterator():
+            
+            if storage.is_legacy_name(name) or has_image_pyramid(storage, name):
+                continue
+            
+            generate_image_pyramid(storage, name)
+            generated_count += 1
+            
+        self.stdout.write(self.style.SUCCESS('Generated thumbnails and tiles for %s images'%generated_count))
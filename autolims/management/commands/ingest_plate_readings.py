@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from autolims.models import Data, PlateReading, PLATE_READING_DATA_TYPES
+
+
+class Command(BaseCommand):
+    help = 'Converts platereader/measure Data json into PlateReading arrays'
+    
+    def handle(self, *args, **options):
+        
+        ingested_count = 0
+        
+        for data in Data.objects.filter(data_type__in=PLATE_READING_DATA_TYPES,
+                                        json__isnull=False)\
+            .select_related('instruction').iterator():
+            
+            if PlateReading.ingest(data):
+                ingested_count += 1
+                
+        self.stdout.write(self.style.SUCCESS('Ingested %s plate readings'%ingested_count))
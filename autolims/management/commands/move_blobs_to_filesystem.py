@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from autolims.models import Data, DataFile, DataImage
+from autolims.blob_storage import ChunkedFileStorage
+
+
+class Command(BaseCommand):
+    help = 'Moves Data files and images stored in postgres by db_file_storage to blob storage'
+    
+    def handle(self, *args, **options):
+        
+        storage = ChunkedFileStorage()
+        
+        moved_count = 0
+        
+        for field_name, blob_model in [('file', DataFile), ('image', DataImage)]:
+            
+            legacy_names = Data.objects.exclude(Q(**{field_name: ''}) | Q(**{'%s__isnull'%field_name: True}))\
+                .values_list(field_name, flat=True).distinct()
+            
+            for legacy_name in [name for name in legacy_names if storage.is_legacy_name(name)]:
+                
+                legacy_file = storage.database_storage.open(legacy_name)
+                
+                #db_file_storage names end with the original filename
+                new_name = storage.save(legacy_name.rsplit('/', 1)[-1], legacy_file)
+                
+                Data.objects.filter(**{field_name: legacy_name}).update(**{field_name: new_name})
+                
+                blob_model.objects.filter(filename=legacy_name).delete()
+                
+                moved_count += 1
+                
+        self.stdout.write(self.style.SUCCESS('Moved %s files to %s'%(moved_count, storage.location)))
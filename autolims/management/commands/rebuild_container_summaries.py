@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from autolims.models import ContainerSummary
+
+
+class Command(BaseCommand):
+    help = 'Recomputes container summaries (filled wells, total volume, last run) from aliquots and effects'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('container_ids', nargs='*', type=int,
+                            help='containers to rebuild (default all)')
+    
+    def handle(self, *args, **options):
+        
+        container_ids = options['container_ids'] or None
+        
+        ContainerSummary.rebuild(container_ids)
+        
+        self.stdout.write(self.style.SUCCESS('Rebuilt container summaries'))
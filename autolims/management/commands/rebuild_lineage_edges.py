@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from autolims.models import Aliquot, AliquotEffect, AliquotLineageEdge
+
+
+class Command(BaseCommand):
+    help = 'Recreates aliquot lineage edges from liquid transfer effects'
+    
+    def handle(self, *args, **options):
+        
+        transfers = list(AliquotEffect.objects.filter(type='liquid_transfer_in')\
+                         .values_list('aliquot_id', 'instruction_id', 'data', 'volume_delta_ul'))
+        
+        source_wells = set((data['source']['container_id'], data['source']['well_idx'])
+                           for _, _, data, _ in transfers 
+                           if data and 'source' in data)
+        
+        source_container_ids = set(container_id for container_id, _ in source_wells)
+        
+        aliquot_ids_by_well = {(container_id, well_idx): aliquot_id for aliquot_id, container_id, well_idx in
+                               Aliquot.objects.filter(container_id__in=source_container_ids)\
+                               .values_list('id', 'container_id', 'well_idx')}
+        
+        edges = []
+        
+        for aliquot_id, instruction_id, data, volume_delta_ul in transfers:
+            if not data or 'source' not in data:
+                continue
+            
+            source_aliquot_id = aliquot_ids_by_well.get((data['source']['container_id'],
+                                                         data['source']['well_idx']))
+            
+            if source_aliquot_id:
+                edges.append(AliquotLineageEdge(source_aliquot_id=source_aliquot_id,
+                                                destination_aliquot_id=aliquot_id,
+                                                instruction_id=instruction_id,
+                                                volume_ul=volume_delta_ul))
+                
+        with transaction.atomic():
+            AliquotLineageEdge.objects.all().delete()
+            AliquotLineageEdge.objects.bulk_create(edges, batch_size=1000)
+            
+        self.stdout.write(self.style.SUCCESS('Created %s lineage edges'%len(edges)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Q, F
+
+from autolims.models import Container, ContainerSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Snapshots aliquot volumes of containers changed since their last snapshot (run periodically)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('container_ids', nargs='*', type=int,
+                            help='containers to snapshot regardless of changes')
+    
+    def handle(self, *args, **options):
+        
+        container_ids = options['container_ids']
+        
+        if not container_ids:
+            container_ids = Container.objects\
+                .annotate(last_aliquot_updated_at=Max('aliquot__updated_at'),
+                          last_snapshot_at=Max('snapshot__taken_at'))\
+                .filter(last_aliquot_updated_at__isnull=False)\
+                .filter(Q(last_snapshot_at__isnull=True) | 
+                        Q(last_aliquot_updated_at__gt=F('last_snapshot_at')))\
+                .values_list('id', flat=True)
+        
+        container_ids = list(container_ids)
+        
+        ContainerSnapshot.take(container_ids)
+        
+        self.stdout.write(self.style.SUCCESS('Snapshotted %s containers'%len(container_ids)))
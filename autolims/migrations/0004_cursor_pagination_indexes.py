@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:11
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0003_auto_20170124_2342'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='aliquot',
+            index_together=set([('created_at', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='container',
+            index_together=set([('created_at', 'id'), ('organization', 'created_at', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='run',
+            index_together=set([('project', 'test_mode', 'status'), ('created_at', 'id')]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0005_aliquot_effect_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContainerSummary',
+            fields=[
+                ('container', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', related_query_name='summary', serialize=False, to='autolims.Container')),
+                ('filled_well_count', models.IntegerField(db_index=True, default=0)),
+                ('total_volume_ul', models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=20)),
+                ('last_touched_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='autolims.Run')),
+            ],
+            options={
+                'verbose_name_plural': 'container summaries',
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:19
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def forwards_merge_duplicate_wells_func(apps, schema_editor):
+    """
+    Merges aliquots sharing a (container, well_idx) into the oldest one.
+    Each duplicate received its own volume changes so volumes are summed, 
+    properties are applied oldest first and well history is moved over.
+    """
+    
+    Aliquot = apps.get_model("autolims", "Aliquot")
+    AliquotEffect = apps.get_model("autolims", "AliquotEffect")
+    db_alias = schema_editor.connection.alias
+    
+    duplicate_wells = Aliquot.objects.using(db_alias)\
+        .values('container_id', 'well_idx')\
+        .annotate(aliquot_count=Count('id'))\
+        .filter(aliquot_count__gt=1)
+    
+    for duplicate_well in list(duplicate_wells):
+        aliquots = list(Aliquot.objects.using(db_alias)\
+                        .filter(container_id=duplicate_well['container_id'],
+                                well_idx=duplicate_well['well_idx'])\
+                        .order_by('id'))
+        
+        kept_aliquot = aliquots[0]
+        duplicate_ids = [aliquot.id for aliquot in aliquots[1:]]
+        
+        properties = {}
+        
+        for aliquot in aliquots:
+            properties.update(aliquot.properties or {})
+            
+        kept_aliquot.properties = properties
+        kept_aliquot.name = next((aliquot.name for aliquot in aliquots if aliquot.name), None)
+        kept_aliquot.volume_ul = str(sum(Decimal(aliquot.volume_ul) for aliquot in aliquots))
+        
+        AliquotEffect.objects.using(db_alias).filter(aliquot_id__in=duplicate_ids)\
+            .update(aliquot=kept_aliquot)
+        
+        Aliquot.objects.using(db_alias).filter(id__in=duplicate_ids).delete()
+        
+        kept_aliquot.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0006_container_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_merge_duplicate_wells_func, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:19
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0007_merge_duplicate_aliquots'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='aliquot',
+            unique_together=set([('container', 'well_idx')]),
+        ),
+    ]
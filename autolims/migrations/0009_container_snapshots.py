@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:21
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0008_aliquot_unique_well'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContainerSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_aliquot_effect_id', models.IntegerField(default=0)),
+                ('aliquots', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('container', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', related_query_name='snapshot', to='autolims.Container')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='aliquoteffect',
+            name='volume_delta_ul',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.AlterIndexTogether(
+            name='containersnapshot',
+            index_together=set([('container', 'last_aliquot_effect_id')]),
+        ),
+    ]
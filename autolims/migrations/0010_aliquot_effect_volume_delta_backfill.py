@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:40
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+
+
+def forwards_backfill_transfer_deltas_func(apps, schema_editor):
+    """
+    Liquid transfers already recorded their volume in data, provision and dispense
+    effects made before volume_delta_ul existed are left at 0
+    """
+    
+    AliquotEffect = apps.get_model("autolims", "AliquotEffect")
+    db_alias = schema_editor.connection.alias
+    
+    effect_ids_by_delta = defaultdict(list)
+    
+    for effect_id, effect_type, data in AliquotEffect.objects.using(db_alias)\
+        .filter(type__in=['liquid_transfer_in', 'liquid_transfer_out'])\
+        .values_list('id', 'type', 'data').iterator():
+        
+        if not data or not data.get('volume_ul'):
+            continue
+        
+        volume_ul = Decimal(data['volume_ul'])
+        
+        effect_ids_by_delta[volume_ul if effect_type == 'liquid_transfer_in' else -volume_ul]\
+            .append(effect_id)
+        
+    for volume_delta_ul, effect_ids in effect_ids_by_delta.items():
+        AliquotEffect.objects.using(db_alias).filter(id__in=effect_ids)\
+            .update(volume_delta_ul=volume_delta_ul)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0009_container_snapshots'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_backfill_transfer_deltas_func, migrations.RunPython.noop),
+    ]
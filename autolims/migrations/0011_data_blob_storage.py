@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0010_aliquot_effect_volume_delta_backfill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='data',
+            name='file',
+            field=models.FileField(blank=True, max_length=255, null=True, upload_to='data'),
+        ),
+        migrations.AlterField(
+            model_name='data',
+            name='image',
+            field=models.ImageField(blank=True, max_length=255, null=True, upload_to='data'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0011_data_blob_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlateReading',
+            fields=[
+                ('data', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='plate_reading', related_query_name='plate_reading', serialize=False, to='autolims.Data')),
+                ('reading_type', models.CharField(blank=True, max_length=200, null=True)),
+                ('well_count', models.IntegerField(default=0)),
+                ('read_count', models.IntegerField(default=0)),
+                ('well_indexes_npy', models.BinaryField()),
+                ('values_npy', models.BinaryField()),
+                ('measured_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('container', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='plate_readings', related_query_name='plate_reading', to='autolims.Container')),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 18:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('autolims', '0012_plate_reading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AliquotLineageEdge',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('volume_ul', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('destination_aliquot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineage_edges_in', related_query_name='lineage_edge_in', to='autolims.Aliquot')),
+                ('instruction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineage_edges', related_query_name='lineage_edge', to='autolims.Instruction')),
+                ('source_aliquot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineage_edges_out', related_query_name='lineage_edge_out', to='autolims.Aliquot')),
+            ],
+        ),
+    ]
@@ -1,6 +1,14 @@
 from __future__ import unicode_literals
 
-from django.db import models
+import io
+from collections import defaultdict
+from decimal import Decimal
+
+import numpy as np
+
+from django.db import models, transaction, connection
+from django.db.models.functions import Concat, Cast
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import JSONField
 from django.utils.encoding import python_2_unicode_compatible
@@ -8,16 +16,19 @@ from transcriptic_tools import utils
 from transcriptic_tools.utils import _CONTAINER_TYPES
 from transcriptic_tools.enums import Temperature, CustomEnum
 from django.core.exceptions import PermissionDenied
+from django.core.urlresolvers import reverse
 from autoprotocol import Unit
 from transcriptic_tools.utils import round_volume
-from db_file_storage.model_utils import delete_file, delete_file_if_needed
+from blob_storage import delete_blob_if_unreferenced
+from image_pyramid import has_image_pyramid, generate_image_pyramid_in_background
 from helper_funcs import str_respresents_int
 
 #create token imports
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 from django.conf import settings
+from django.core.cache import cache
 
 
 COVER_TYPES = set()
@@ -41,6 +52,8 @@ RESOURCE_KINDS = ['Reagent','NucleicAcid']
 
 DEFAULT_ORGANIZATION = 1
 
+ORGANIZATION_MEMBERSHIP_CACHE_KEY = 'autolims_org_membership_%s'
+
 @python_2_unicode_compatible
 class Organization(models.Model):
     name = models.CharField(max_length=200,blank=True,
@@ -60,6 +73,34 @@ class Organization(models.Model):
     #custom fields
     updated_at = models.DateTimeField(auto_now=True)    
     
+    @classmethod
+    def get_user_organizations_by_subdomain(cls, user):
+        """
+        Returns a dict of subdomain -> Organization for every org the user belongs to.
+        
+        The result is cached per user for settings.ORGANIZATION_MEMBERSHIP_CACHE_TIMEOUT
+        seconds and invalidated when memberships or orgs change (see signals below)
+        """
+        
+        if not user.is_authenticated:
+            return {}
+        
+        cache_key = ORGANIZATION_MEMBERSHIP_CACHE_KEY%user.id
+        
+        organizations = cache.get(cache_key)
+        
+        if organizations is None:
+            organizations = {organization.subdomain: organization \
+                             for organization in cls.objects.filter(users=user)}
+            cache.set(cache_key, organizations,
+                      settings.ORGANIZATION_MEMBERSHIP_CACHE_TIMEOUT)
+            
+        return organizations
+    
+    @classmethod
+    def clear_membership_cache(cls, user_ids):
+        cache.delete_many([ORGANIZATION_MEMBERSHIP_CACHE_KEY%user_id for user_id in user_ids])
+    
     def get_absolute_url(self):
         return "/%s/" % self.subdomain    
     
@@ -115,6 +156,18 @@ class RunContainer(models.Model):
         unique_together = ('run', 'container_label', )        
     
    
+class BulkCreateError(Exception):
+    """
+    Raised by Run.bulk_create before anything is written when some runs can't be
+    created. errors has one entry per run, the exception for that run or None
+    """
+    
+    def __init__(self, errors):
+        super(BulkCreateError, self).__init__('%s of %s runs can\'t be created'%(
+            len([error for error in errors if error]), len(errors)))
+        self.errors = errors
+        
+   
 @python_2_unicode_compatible 
 class Run(models.Model):
     
@@ -203,11 +256,7 @@ class Run(models.Model):
             new_run = True
             self.convert_transcriptic_resource_ids()
             
-        if not isinstance(self.properties,dict):
-            self.properties = {}
-            
-        assert self.status in RUN_STATUS_CHOICES,\
-            'status \'%s\' not found in allowed options %s'%(self.status, str(RUN_STATUS_CHOICES))
+        self.clean_new_fields()
                 
         super(Run, self).save(*args, **kw)
         
@@ -220,54 +269,195 @@ class Run(models.Model):
             self.create_instructions()
             self.populate_containers()            
     
-    def convert_transcriptic_resource_ids(self):
+    @classmethod
+    def bulk_create(cls, runs):
+        """
+        Creates new (unsaved) runs along with their instructions and containers
+        in one transaction, with one bulk insert per table instead of the 
+        per run save pipeline.
+        
+        Every run is checked first (resources, referenced containers), if any can't
+        be created BulkCreateError is raised and nothing is written.
+        
+        Returns the runs with ids set
+        """
+        
+        transcriptic_ids = set()
+        existing_container_ids = set()
+        
+        for run in runs:
+            transcriptic_ids.update(run.get_transcriptic_resource_ids())
+            
+            #bad ids are reported when the run is checked below
+            try:
+                existing_container_ids.update(run.get_existing_container_ids())
+            except ValueError:
+                pass
+        
+        resource_ids_by_transcriptic_id = Resource.get_ids_by_transcriptic_id(transcriptic_ids)
+        existing_containers = Container.objects.in_bulk(existing_container_ids)
+        
+        #every run is checked before anything is written so each bad run gets its own error
+        errors = []
+        
+        for run in runs:
+            try:
+                run.convert_transcriptic_resource_ids(resource_ids_by_transcriptic_id)
+                run.clean_new_fields()
+                
+                for container_id in run.get_existing_container_ids():
+                    if container_id not in existing_containers:
+                        raise Container.DoesNotExist('No container with id %s'%container_id)
+                    
+                    run.check_existing_container(existing_containers[container_id])
+                    
+            except Exception as e:
+                errors.append(e)
+            else:
+                errors.append(None)
+                
+        if any(errors):
+            raise BulkCreateError(errors)
+        
+        with transaction.atomic():
+        
+            #ids are set on the runs by postgres
+            cls.objects.bulk_create(runs)
+            
+            untitled_runs = [run for run in runs if not run.title]
+            
+            for run in untitled_runs:
+                run.title = 'Run %s'%run.id
+                
+            if untitled_runs:
+                cls.objects.filter(id__in=[run.id for run in untitled_runs])\
+                    .update(title=Concat(models.Value('Run '), Cast('id', models.TextField())))
+            
+            Instruction.objects.bulk_create([instruction for run in runs
+                                             for instruction in run.build_instructions()])
+            
+            #(run, label, container) 
+            run_container_infos = [(run, label, container) for run in runs
+                                   for label, container in run.build_containers(existing_containers)]
+            
+            new_containers = [container for run, label, container in run_container_infos
+                              if container.id is None]
+            
+            #bulk inserts don't send post_save
+            Container.objects.bulk_create(new_containers)
+            ContainerSummary.objects.bulk_create([ContainerSummary(container=container) 
+                                                  for container in new_containers])
+            
+            RunContainer.objects.bulk_create([RunContainer(run=run,
+                                                           container=container,
+                                                           container_label=label) 
+                                              for run, label, container in run_container_infos])
+            
+        return runs
+    
+    def clean_new_fields(self):
+        if not isinstance(self.properties,dict):
+            self.properties = {}
+            
+        assert self.status in RUN_STATUS_CHOICES,\
+            'status \'%s\' not found in allowed options %s'%(self.status, str(RUN_STATUS_CHOICES))        
+    
+    def get_existing_container_ids(self):
+        return [int(ref_dict['id']) for ref_dict in self.protocol['refs'].values() 
+                if 'new' not in ref_dict]
+    
+    def check_existing_container(self, container):
+        """
+        Raises if an existing container can't be used by this run
+        """
+        
+        if container.status == 'destroyed':
+            raise Exception('Destoryed container referenced in run: Container id %s'%container.id)
+        
+        if container.organization_id != self.project.organization_id:
+            raise PermissionDenied('Container %s doesn\'t belong to your org'%container.id)
+    
+    def get_transcriptic_resource_ids(self):
+        return [operation['resource_id'] for operation in self.protocol['instructions']
+                if operation['op'] == 'provision' and \
+                isinstance(operation['resource_id'], basestring) and \
+                not str_respresents_int(operation['resource_id'])]
+    
+    def convert_transcriptic_resource_ids(self, resource_ids_by_transcriptic_id=None):
+        
+        if resource_ids_by_transcriptic_id is None:
+            resource_ids_by_transcriptic_id = Resource.get_ids_by_transcriptic_id(
+                self.get_transcriptic_resource_ids())
+        
         for operation in self.protocol['instructions']:
             if operation['op'] != 'provision': continue
             if not isinstance(operation['resource_id'], basestring) or \
                str_respresents_int(operation['resource_id']): continue
             
-            resource = Resource.objects.get(transcriptic_id = operation['resource_id'])
+            if operation['resource_id'] not in resource_ids_by_transcriptic_id:
+                raise Resource.DoesNotExist('No resource with transcriptic id %s'%operation['resource_id'])
             
-            operation['resource_id'] = resource.id
+            operation['resource_id'] = resource_ids_by_transcriptic_id[operation['resource_id']]
                                    
+    def build_instructions(self):
+        return [Instruction(run = self,
+                            operation = instruction_dict,
+                            sequence_no = i) 
+                for i, instruction_dict in enumerate(self.protocol['instructions'])]
                                 
     def create_instructions(self):
-        for i, instruction_dict in enumerate(self.protocol['instructions']):
-            instruction = Instruction.objects.create(run = self,
-                                                     operation = instruction_dict,
-                                                     sequence_no = i)
-    
-    def populate_containers(self):
+        Instruction.objects.bulk_create(self.build_instructions())
         
-        organization = self.project.organization
+    def build_containers(self, existing_containers=None):
+        """
+        Returns (label, container) pairs for the refs of the protocol. New
+        containers are unsaved, existing containers are checked to be usable by this run.
+        
+        existing_containers is an optional dict of container id -> Container, 
+        containers not in it are looked up
+        """
+        
+        organization_id = self.project.organization_id
+        
+        containers = []
         
         for label, ref_dict in self.protocol['refs'].items():
             if 'new' in ref_dict:
                 
                 storage_condition = ref_dict['store']['where'] if 'store' in ref_dict else None
                 
-                new_container = Container.objects.create(container_type_id = ref_dict['new'],
-                                                      label = label,
-                                                      test_mode = self.test_mode,
-                                                      storage_condition = storage_condition,
-                                                      status = 'available',
-                                                      generated_by_run = self,
-                                                      organization = organization
-                                                      )
-                self.add_container(new_container, label=label)
+                new_container = Container(container_type_id = ref_dict['new'],
+                                          label = label,
+                                          test_mode = self.test_mode,
+                                          storage_condition = storage_condition,
+                                          status = 'available',
+                                          generated_by_run = self,
+                                          organization_id = organization_id,
+                                          properties = {}
+                                          )
+                containers.append((label, new_container))
             else:
                 
                 #check that the existing container belongs to this org
                 
-                existing_container = Container.objects.get(id=ref_dict['id'])
+                if existing_containers is not None and int(ref_dict['id']) in existing_containers:
+                    existing_container = existing_containers[int(ref_dict['id'])]
+                else:
+                    existing_container = Container.objects.get(id=ref_dict['id'])
+                
+                self.check_existing_container(existing_container)
                 
-                if existing_container.status == 'destroyed':
-                    raise Exception('Destoryed container referenced in run: Container id %s'%existing_container.id)
+                containers.append((label, existing_container))
                 
-                if existing_container.organization_id != self.project.organization_id:
-                    raise PermissionDenied('Container %s doesn\'t belong to your org'%existing_container.id)
+        return containers
+    
+    def populate_containers(self):
+        
+        for label, container in self.build_containers():
+            if container.id is None:
+                container.save()
                 
-                self.add_container(existing_container, label=label)
+            self.add_container(container, label=label)
     
     def __str__(self):
         return self.title    
@@ -278,7 +468,9 @@ class Run(models.Model):
     
     class Meta:
         index_together = [
-            ['project','test_mode','status']
+            ['project','test_mode','status'],
+            #cursor pagination
+            ['created_at','id']
         ]
 
 
@@ -468,6 +660,19 @@ class Container(models.Model):
     
     def __str__(self):
         return '%s (%s)'%(self.label,self.id) if self.label else 'Container %s'%self.id 
+    
+    class Meta:
+        index_together = [
+            #cursor pagination
+            ['organization','created_at','id'],
+            ['created_at','id']
+        ]
+
+#type volume_ul (a string to keep precision) is cast to for math in the db
+VOLUME_UL_DB_FIELD = models.DecimalField(max_digits=20, decimal_places=2)
+
+#rows per INSERT when creating missing aliquots (see Aliquot.get_or_create_many)
+ALIQUOT_INSERT_BATCH_SIZE = 500
 
 @python_2_unicode_compatible
 class Aliquot(models.Model):
@@ -540,6 +745,120 @@ class Aliquot(models.Model):
             subtracted_volume = Unit(volume_to_add,'microliter')
     
         return self.add_volume(-1*subtracted_volume)   
+    
+    @classmethod
+    def get_volume_delta_ul(cls, volume):
+        """
+        Converts a volume (string e.g. '5:nanoliter', Unit or number of microliters) into 
+        a Decimal of microliters at instrument precision (0.01uL)
+        """
+        
+        if isinstance(volume,basestring) and ':' in volume:
+            volume = Unit(volume)
+        elif not isinstance(volume, Unit):
+            volume = Unit(volume,'microliter')
+            
+        return Decimal(str(round_volume(volume,2).magnitude)).quantize(Decimal('0.01'))
+    
+    @classmethod
+    def add_volumes(cls, volume_deltas_ul):
+        """
+        Applies volume changes in the db without reading the aliquots first,
+        i.e. UPDATE ... SET volume_ul = volume_ul + delta, so concurrent runs 
+        can't lose each other's updates. Only volume_ul and updated_at are written.
+        
+        volume_deltas_ul is a dict of aliquot id -> Decimal microliters (see get_volume_delta_ul).
+        Aliquots getting the same delta share one UPDATE.
+        """
+        
+        aliquot_ids_by_delta = defaultdict(list)
+        
+        for aliquot_id, delta in volume_deltas_ul.items():
+            if delta:
+                aliquot_ids_by_delta[delta].append(aliquot_id)
+                
+        updated_at = timezone.now()
+        
+        for delta, aliquot_ids in aliquot_ids_by_delta.items():
+            cls.objects.filter(id__in=aliquot_ids)\
+                .update(volume_ul=Cast(Cast('volume_ul', VOLUME_UL_DB_FIELD) + \
+                                       models.Value(delta, output_field=VOLUME_UL_DB_FIELD),
+                                       models.TextField()),
+                        updated_at=updated_at)
+            
+    @classmethod
+    def get_or_create_by_well_idx(cls, container_id, well_idx):
+        """
+        Single well version of get_or_create_many
+        """
+        
+        return cls.get_or_create_many(container_id, [well_idx])[well_idx]
+    
+    @classmethod
+    def get_or_create_many(cls, container_id, well_indexes):
+        """
+        Returns a dict of well_idx -> aliquot for the container, creating empty aliquots
+        for missing wells. 
+        
+        Missing wells are inserted with INSERT ... ON CONFLICT DO NOTHING RETURNING in 
+        batches, so runs executing concurrently can't create duplicate wells (see the 
+        unique (container, well_idx) constraint). Wells another run created in the 
+        meantime are read back afterwards.
+        """
+        
+        well_indexes = set(well_indexes)
+        
+        aliquots_by_well_idx = {aliquot.well_idx: aliquot for aliquot in 
+                                cls.objects.filter(container_id=container_id,
+                                                   well_idx__in=well_indexes)}
+        
+        missing_well_indexes = sorted(well_indexes - set(aliquots_by_well_idx.keys()))
+        
+        for i in range(0, len(missing_well_indexes), ALIQUOT_INSERT_BATCH_SIZE):
+            for aliquot in cls._insert_empty(container_id, 
+                                             missing_well_indexes[i:i+ALIQUOT_INSERT_BATCH_SIZE]):
+                aliquots_by_well_idx[aliquot.well_idx] = aliquot
+                
+        conflicting_well_indexes = [well_idx for well_idx in missing_well_indexes 
+                                    if well_idx not in aliquots_by_well_idx]
+        
+        if conflicting_well_indexes:
+            aliquots_by_well_idx.update({aliquot.well_idx: aliquot for aliquot in 
+                                         cls.objects.filter(container_id=container_id,
+                                                            well_idx__in=conflicting_well_indexes)})
+            
+        return aliquots_by_well_idx
+    
+    @classmethod
+    def _insert_empty(cls, container_id, well_indexes):
+        """
+        Inserts empty aliquots, skipping wells that already exist. 
+        Returns only the aliquots that were inserted.
+        """
+        
+        if not well_indexes:
+            return []
+        
+        quote_name = connection.ops.quote_name
+        
+        columns = [cls._meta.get_field(field_name).column for field_name in 
+                   ['container', 'well_idx', 'volume_ul', 'properties', 'created_at', 'updated_at']]
+        
+        now = timezone.now()
+        
+        params = []
+        
+        for well_idx in well_indexes:
+            params.extend([container_id, well_idx, '0', '{}', now, now])
+        
+        sql = 'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s, %s) DO NOTHING RETURNING *'%(
+            quote_name(cls._meta.db_table),
+            ', '.join(quote_name(column) for column in columns),
+            ', '.join(['(%s, %s, %s, %s::jsonb, %s, %s)']*len(well_indexes)),
+            quote_name(columns[0]),
+            quote_name(columns[1]))
+        
+        return list(cls.objects.raw(sql, params))
             
     
     def save(self,*args, **kwargs):
@@ -552,6 +871,13 @@ class Aliquot(models.Model):
     def __str__(self):
         return '%s/%s'%(self.container.label,self.well_idx)
     
+    class Meta:
+        unique_together = ('container', 'well_idx',)
+        index_together = [
+            #cursor pagination
+            ['created_at','id']
+        ]
+    
     
     
 @python_2_unicode_compatible
@@ -607,10 +933,10 @@ class Data(models.Model):
     sequence_no = models.IntegerField(null=False,blank=False,
                                       default=0)    
     
-    #upload_to isn't used but is required
-    image = models.ImageField(upload_to='autolims.DataImage/bytes/filename/mimetype', null=True, blank=True)
+    #stored by content hash (see blob_storage), upload_to isn't used but is required
+    image = models.ImageField(upload_to='data', max_length=255, null=True, blank=True)
     
-    file = models.FileField(upload_to='autolims.DataFile/bytes/filename/mimetype', null=True, blank=True)
+    file = models.FileField(upload_to='data', max_length=255, null=True, blank=True)
     
     json = JSONField(null=True,blank=True)
     
@@ -638,20 +964,208 @@ class Data(models.Model):
         if self.run and self.instruction and self.run_id != self.instruction.run_id:
             raise Exception, "Instruction must belong to the run of this data object"
         
+        previous_names = Data.objects.filter(pk=self.pk).values('file', 'image').first() \
+            if self.pk else None
+        
         super(Data, self).save(*args, **kwargs)
         
-        delete_file_if_needed(self, 'file')
-        delete_file_if_needed(self, 'image')        
+        #delete replaced files
+        if previous_names:
+            for field_name in ['file', 'image']:
+                previous_name = previous_names[field_name]
+                if previous_name and previous_name != getattr(self, field_name).name:
+                    delete_blob_if_unreferenced(Data, ['file', 'image'], previous_name)
         
     def delete(self, *args, **kwargs):
         super(Data, self).delete(*args, **kwargs)
-        delete_file(self, 'file')
-        delete_file(self, 'image')    
         
+        for field_name in ['file', 'image']:
+            if getattr(self, field_name):
+                delete_blob_if_unreferenced(Data, ['file', 'image'], getattr(self, field_name).name)
+        
+    
+    @property
+    def image_thumbnail_url(self):
+        if not self.image or self.image.storage.is_legacy_name(self.image.name):
+            return None
+        
+        return reverse('image_pyramid', kwargs={'name': self.image.name,
+                                                'part': 'thumbnail.jpg'})
     
     def __str__(self):
         return "Data %s"%self.id
 
+#data types whose json is well -> reading(s)
+PLATE_READING_DATA_TYPES = ['platereader', 'measure']
+
+@python_2_unicode_compatible
+class PlateReading(models.Model):
+    """
+    The readings of a platereader/measure Data row as numpy arrays, so analyses 
+    across many plates are array operations instead of json parsing per well.
+    
+    values is a (wells x reads) float array aligned with well_indexes, 
+    missing reads are nan.
+    """
+    
+    data = models.OneToOneField(Data, on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='plate_reading',
+                                related_query_name='plate_reading',
+                                db_constraint=True)
+    
+    container = models.ForeignKey(Container, on_delete=models.CASCADE,
+                                  related_name='plate_readings',
+                                  related_query_name='plate_reading',
+                                  db_constraint=True,
+                                  null=True,
+                                  blank=True)
+    
+    #instruction op, e.g. absorbance, fluorescence, luminescence
+    reading_type = models.CharField(max_length=200, null=True, blank=True)
+    
+    well_count = models.IntegerField(default=0)
+    read_count = models.IntegerField(default=0)
+    
+    #npy encoded arrays
+    well_indexes_npy = models.BinaryField()
+    values_npy = models.BinaryField()
+    
+    measured_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    @staticmethod
+    def _encode_array(array):
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        return buffer.getvalue()
+    
+    @staticmethod
+    def _decode_array(npy_bytes):
+        return np.load(io.BytesIO(bytes(npy_bytes)), allow_pickle=False)
+    
+    @property
+    def well_indexes(self):
+        if not hasattr(self, '_well_indexes'):
+            self._well_indexes = self._decode_array(self.well_indexes_npy)
+        return self._well_indexes
+    
+    @property
+    def values(self):
+        if not hasattr(self, '_values'):
+            self._values = self._decode_array(self.values_npy)
+        return self._values
+    
+    def get_plate_array(self, well_count=None, reduce_reads=np.nanmean):
+        """
+        One value per well of the plate, indexed by well_idx (nan for unread wells).
+        Multiple reads of a well are combined with reduce_reads.
+        """
+        
+        if well_count is None:
+            well_count = _CONTAINER_TYPES[self.container.container_type_id].well_count \
+                if self.container_id else int(self.well_indexes.max()) + 1 if self.well_count else 0
+        
+        plate_array = np.full(well_count, np.nan)
+        
+        if self.well_count:
+            plate_array[self.well_indexes] = reduce_reads(self.values, axis=1)
+            
+        return plate_array
+    
+    @classmethod
+    def stack(cls, plate_readings, well_count=None, reduce_reads=np.nanmean):
+        """
+        Returns (measured_at list, readings x wells array), e.g. growth curves are 
+        the columns of stack(container.plate_readings.order_by('measured_at'))
+        """
+        
+        plate_readings = list(plate_readings)
+        
+        if not plate_readings:
+            return [], np.empty((0, well_count or 0))
+        
+        if well_count is None:
+            well_count = max(len(plate_reading.get_plate_array(reduce_reads=reduce_reads)) 
+                             for plate_reading in plate_readings)
+        
+        return ([plate_reading.measured_at for plate_reading in plate_readings],
+                np.vstack([plate_reading.get_plate_array(well_count, reduce_reads) 
+                           for plate_reading in plate_readings]))
+    
+    @classmethod
+    def parse_readings(cls, readings_by_well, container_type=None):
+        """
+        Converts {well: reading or [readings]} into (well_indexes, values) arrays.
+        Keys that aren't wells of the container type are skipped.
+        """
+        
+        readings = {}
+        
+        for well, well_readings in readings_by_well.items():
+            try:
+                well_idx = container_type.robotize(well) if container_type else int(well)
+            except (ValueError, TypeError):
+                continue
+            
+            if not isinstance(well_readings, list):
+                well_readings = [well_readings]
+                
+            readings[well_idx] = [reading if isinstance(reading, (int, long, float)) 
+                                  and not isinstance(reading, bool) else np.nan
+                                  for reading in well_readings]
+            
+        well_indexes = np.array(sorted(readings.keys()), dtype=np.int32)
+        
+        read_count = max([len(well_readings) for well_readings in readings.values()] or [0])
+        
+        values = np.full((len(well_indexes), read_count), np.nan)
+        
+        for i, well_idx in enumerate(well_indexes):
+            values[i, :len(readings[well_idx])] = readings[well_idx]
+            
+        return well_indexes, values
+    
+    @classmethod
+    def ingest(cls, data):
+        """
+        Creates or replaces the PlateReading of a platereader/measure Data row
+        """
+        
+        if data.data_type not in PLATE_READING_DATA_TYPES or not isinstance(data.json, dict):
+            return None
+        
+        container = None
+        reading_type = None
+        measured_at = timezone.now()
+        
+        if data.instruction_id:
+            instruction = data.instruction
+            reading_type = instruction.operation.get('op')
+            measured_at = instruction.completed_at or measured_at
+            
+            if instruction.operation.get('object'):
+                container = Container.get_container_from_run_and_container_label(instruction.run_id,
+                                                                                 instruction.operation['object'])
+                
+        container_type = _CONTAINER_TYPES.get(container.container_type_id) if container else None
+        
+        well_indexes, values = cls.parse_readings(data.json, container_type)
+        
+        plate_reading, created = cls.objects.update_or_create(data=data, defaults={
+            'container': container,
+            'reading_type': reading_type,
+            'well_count': values.shape[0],
+            'read_count': values.shape[1],
+            'well_indexes_npy': cls._encode_array(well_indexes),
+            'values_npy': cls._encode_array(values),
+            'measured_at': measured_at
+        })
+        
+        return plate_reading
+    
+    def __str__(self):
+        return 'Plate Reading %s'%self.data_id
+
 @python_2_unicode_compatible
 class AliquotEffect(models.Model):
     #visible in network console as aliquot_effects when loading a well at transcriptic
@@ -670,6 +1184,10 @@ class AliquotEffect(models.Model):
     
     data = JSONField(blank=True,null=True)  
     
+    #signed change to the aliquot's volume, replayed by ContainerSnapshot.get_state
+    volume_delta_ul = models.DecimalField(max_digits=20, decimal_places=2,
+                                          default=0, null=False, blank=False)
+    
     type = models.CharField(max_length=200,
                                    choices=zip(ALIQUOT_EFFECT_TYPES,
                                                ALIQUOT_EFFECT_TYPES),
@@ -678,7 +1196,8 @@ class AliquotEffect(models.Model):
                                    blank=False)
     
     deleted_at = models.DateTimeField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)    
+    #indexed for time range exports
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)    
     
     updated_at = models.DateTimeField(auto_now=True)   
     
@@ -686,6 +1205,391 @@ class AliquotEffect(models.Model):
     def __str__(self):
         return 'Aliquot Effect %s'%self.id
 
+@python_2_unicode_compatible
+class ContainerSummary(models.Model):
+    """
+    Totals over a container's aliquots. Kept up to date incrementally by the interpreter 
+    and by signals for other edits so lists can show, sort and filter on them 
+    without loading aliquots.
+    
+    Rebuild with `manage.py rebuild_container_summaries`
+    """
+    
+    container = models.OneToOneField(Container, on_delete=models.CASCADE,
+                                     primary_key=True,
+                                     related_name='summary',
+                                     related_query_name='summary',
+                                     db_constraint=True)
+    
+    #wells with volume > 0
+    filled_well_count = models.IntegerField(default=0, null=False, db_index=True)
+    
+    total_volume_ul = models.DecimalField(max_digits=20, decimal_places=2, default=0,
+                                          null=False, db_index=True)
+    
+    last_run = models.ForeignKey(Run, on_delete=models.SET_NULL,
+                                 related_name='+',
+                                 db_constraint=True,
+                                 null=True,
+                                 blank=True)
+    
+    last_touched_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "container summaries"
+    
+    @classmethod
+    def ensure_summaries_exist(cls, container_ids):
+        container_ids = set(container_ids)
+        
+        existing_container_ids = set(cls.objects.filter(container_id__in=container_ids)\
+                                     .values_list('container_id', flat=True))
+        
+        cls.objects.bulk_create([cls(container_id=container_id) 
+                                 for container_id in container_ids - existing_container_ids])
+    
+    @classmethod
+    def add_volumes(cls, volume_deltas_ul_by_container_id):
+        """
+        Applies the total volume change of each container in the db (like Aliquot.add_volumes) 
+        and recounts filled wells for those containers only.
+        
+        Call after the aliquot volumes have been updated.
+        """
+        
+        container_ids = volume_deltas_ul_by_container_id.keys()
+        
+        if not container_ids:
+            return
+        
+        cls.ensure_summaries_exist(container_ids)
+        
+        container_ids_by_delta = defaultdict(list)
+        
+        for container_id, delta in volume_deltas_ul_by_container_id.items():
+            if delta:
+                container_ids_by_delta[delta].append(container_id)
+                
+        for delta, delta_container_ids in container_ids_by_delta.items():
+            cls.objects.filter(container_id__in=delta_container_ids)\
+                .update(total_volume_ul=models.F('total_volume_ul') + delta,
+                        updated_at=timezone.now())
+            
+        cls.update_filled_well_counts(container_ids)
+        
+    @classmethod
+    def update_filled_well_counts(cls, container_ids):
+        
+        filled_well_counts = dict(Aliquot.objects.filter(container_id__in=container_ids)\
+                                  .annotate(volume=Cast('volume_ul', VOLUME_UL_DB_FIELD))\
+                                  .filter(volume__gt=0)\
+                                  .values('container_id')\
+                                  .annotate(filled_well_count=models.Count('id'))\
+                                  .values_list('container_id','filled_well_count'))
+        
+        container_ids_by_count = defaultdict(list)
+        
+        for container_id in container_ids:
+            container_ids_by_count[filled_well_counts.get(container_id, 0)].append(container_id)
+            
+        for filled_well_count, count_container_ids in container_ids_by_count.items():
+            cls.objects.filter(container_id__in=count_container_ids)\
+                .update(filled_well_count=filled_well_count,
+                        updated_at=timezone.now())
+            
+    @classmethod
+    def mark_touched(cls, run):
+        """
+        Records the run as the last run to touch each of its containers
+        """
+        
+        container_ids = run.run_containers.values_list('container_id', flat=True)
+        
+        cls.ensure_summaries_exist(container_ids)
+        
+        cls.objects.filter(container_id__in=container_ids)\
+            .update(last_run=run,
+                    last_touched_at=timezone.now(),
+                    updated_at=timezone.now())
+        
+    @classmethod
+    def refresh_volumes(cls, container_ids):
+        """
+        Recomputes the volume totals of existing summaries from their aliquots
+        """
+        
+        total_volumes = dict(Aliquot.objects.filter(container_id__in=container_ids)\
+                             .values('container_id')\
+                             .annotate(total_volume_ul=models.Sum(Cast('volume_ul', VOLUME_UL_DB_FIELD)))\
+                             .values_list('container_id', 'total_volume_ul'))
+        
+        container_ids_by_total = defaultdict(list)
+        
+        for container_id in container_ids:
+            container_ids_by_total[total_volumes.get(container_id) or 0].append(container_id)
+            
+        for total_volume_ul, total_container_ids in container_ids_by_total.items():
+            cls.objects.filter(container_id__in=total_container_ids)\
+                .update(total_volume_ul=total_volume_ul,
+                        updated_at=timezone.now())
+            
+        cls.update_filled_well_counts(container_ids)
+        
+    @classmethod
+    def rebuild(cls, container_ids=None):
+        """
+        Recomputes summaries from scratch for the given containers (default all)
+        """
+        
+        containers = Container.objects.all()
+        
+        if container_ids is not None:
+            containers = containers.filter(id__in=container_ids)
+            
+        container_ids = list(containers.values_list('id', flat=True))
+        
+        aliquots = Aliquot.objects.filter(container_id__in=container_ids)
+        
+        total_volumes = dict(aliquots.values('container_id')\
+                             .annotate(total_volume_ul=models.Sum(Cast('volume_ul', VOLUME_UL_DB_FIELD)))\
+                             .values_list('container_id', 'total_volume_ul'))
+        
+        last_effect_ids = AliquotEffect.objects.filter(aliquot__container_id__in=container_ids)\
+            .values('aliquot__container_id')\
+            .annotate(last_effect_id=models.Max('id'))\
+            .values_list('last_effect_id', flat=True)
+        
+        last_effects = {aliquot_effect['aliquot__container_id']: aliquot_effect for aliquot_effect in 
+                        AliquotEffect.objects.filter(id__in=list(last_effect_ids))\
+                        .values('aliquot__container_id', 'instruction__run_id', 'created_at')}
+        
+        with transaction.atomic():
+            cls.objects.filter(container_id__in=container_ids).delete()
+            
+            cls.objects.bulk_create([cls(container_id=container_id,
+                                         total_volume_ul=total_volumes.get(container_id) or 0,
+                                         last_run_id=last_effects[container_id]['instruction__run_id'] \
+                                         if container_id in last_effects else None,
+                                         last_touched_at=last_effects[container_id]['created_at'] \
+                                         if container_id in last_effects else None)
+                                     for container_id in container_ids])
+            
+            cls.update_filled_well_counts(container_ids)
+    
+    def __str__(self):
+        return 'Container Summary %s'%self.container_id
+
+@python_2_unicode_compatible
+class ContainerSnapshot(models.Model):
+    """
+    Aliquot volumes of a container as of an aliquot effect. The volume at any point 
+    in time is the nearest earlier snapshot plus the volume deltas of later effects.
+    
+    Volume edits made outside of runs aren't effects, they are picked up by the next
+    snapshot (see `manage.py snapshot_containers`)
+    """
+    
+    container = models.ForeignKey(Container, on_delete=models.CASCADE,
+                                  related_name='snapshots',
+                                  related_query_name='snapshot',
+                                  db_constraint=True)
+    
+    #newest effect on the container included in the snapshot (0 for none)
+    last_aliquot_effect_id = models.IntegerField(default=0, null=False, blank=False)
+    
+    #aliquot id -> {'well_idx':..., 'volume_ul':...}
+    aliquots = JSONField(default=dict)
+    
+    taken_at = models.DateTimeField(default=timezone.now)
+    
+    @classmethod
+    def take(cls, container_ids):
+        """
+        Snapshots the current aliquot volumes of each container
+        """
+        
+        container_ids = list(container_ids)
+        
+        aliquots_by_container_id = defaultdict(dict)
+        
+        for aliquot_id, container_id, well_idx, volume_ul in Aliquot.objects\
+            .filter(container_id__in=container_ids)\
+            .values_list('id', 'container_id', 'well_idx', 'volume_ul'):
+            aliquots_by_container_id[container_id][str(aliquot_id)] = {'well_idx': well_idx,
+                                                                       'volume_ul': volume_ul}
+        
+        last_effect_ids = dict(AliquotEffect.objects.filter(aliquot__container_id__in=container_ids)\
+                               .values('aliquot__container_id')\
+                               .annotate(last_effect_id=models.Max('id'))\
+                               .values_list('aliquot__container_id', 'last_effect_id'))
+        
+        taken_at = timezone.now()
+        
+        cls.objects.bulk_create([cls(container_id=container_id,
+                                     last_aliquot_effect_id=last_effect_ids.get(container_id, 0),
+                                     aliquots=aliquots_by_container_id[container_id],
+                                     taken_at=taken_at)
+                                 for container_id in container_ids])
+        
+    @classmethod
+    def take_if_needed(cls, container_ids):
+        """
+        Snapshots containers without a snapshot or with more than 
+        CONTAINER_SNAPSHOT_EFFECT_INTERVAL effects since their last one
+        """
+        
+        container_ids = list(container_ids)
+        
+        last_snapshot_effect_ids = dict(cls.objects.filter(container_id__in=container_ids)\
+                                        .values('container_id')\
+                                        .annotate(last_effect_id=models.Max('last_aliquot_effect_id'))\
+                                        .values_list('container_id', 'last_effect_id'))
+        
+        stale_container_ids = [container_id for container_id in container_ids
+                               if container_id not in last_snapshot_effect_ids]
+        
+        for container_id, last_effect_id in last_snapshot_effect_ids.items():
+            if AliquotEffect.objects.filter(aliquot__container_id=container_id,
+                                            id__gt=last_effect_id)\
+               [settings.CONTAINER_SNAPSHOT_EFFECT_INTERVAL:].exists():
+                stale_container_ids.append(container_id)
+                
+        cls.take(stale_container_ids)
+        
+    @classmethod
+    def get_state(cls, container_id, at=None, before_run_id=None):
+        """
+        Aliquot volumes of the container at a time or just before a run executed.
+        Returns (snapshot or None, list of {'aliquot_id', 'well_idx', 'volume_ul'})
+        """
+        
+        snapshots = cls.objects.filter(container_id=container_id)
+        effects = AliquotEffect.objects.filter(aliquot__container_id=container_id)
+        
+        if before_run_id is not None:
+            first_run_effect_id = AliquotEffect.objects.filter(instruction__run_id=before_run_id)\
+                .aggregate(first_effect_id=models.Min('id'))['first_effect_id']
+            
+            if first_run_effect_id is None:
+                raise ValueError('Run %s has no recorded effects'%before_run_id)
+            
+            snapshots = snapshots.filter(last_aliquot_effect_id__lt=first_run_effect_id)
+            effects = effects.filter(id__lt=first_run_effect_id)
+            
+        if at is not None:
+            snapshots = snapshots.filter(taken_at__lte=at)
+            effects = effects.filter(created_at__lte=at)
+            
+        snapshot = snapshots.order_by('-last_aliquot_effect_id', '-taken_at').first()
+        
+        aliquots = {}
+        
+        if snapshot:
+            effects = effects.filter(id__gt=snapshot.last_aliquot_effect_id)
+            
+            for aliquot_id, aliquot_info in snapshot.aliquots.items():
+                aliquots[int(aliquot_id)] = {'aliquot_id': int(aliquot_id),
+                                             'well_idx': aliquot_info['well_idx'],
+                                             'volume_ul': Decimal(aliquot_info['volume_ul'])}
+        
+        for effect_totals in effects.values('aliquot_id', 'aliquot__well_idx')\
+            .annotate(volume_delta_ul=models.Sum('volume_delta_ul')):
+            
+            aliquot = aliquots.setdefault(effect_totals['aliquot_id'],
+                                          {'aliquot_id': effect_totals['aliquot_id'],
+                                           'well_idx': effect_totals['aliquot__well_idx'],
+                                           'volume_ul': Decimal(0)})
+            aliquot['volume_ul'] += effect_totals['volume_delta_ul']
+            
+        return snapshot, sorted(aliquots.values(), key=lambda aliquot: aliquot['well_idx'])
+    
+    def __str__(self):
+        return 'Container Snapshot %s'%self.id
+    
+    class Meta:
+        index_together = [
+            ['container', 'last_aliquot_effect_id'],
+        ]
+
+@python_2_unicode_compatible
+class AliquotLineageEdge(models.Model):
+    """
+    A liquid transfer from one aliquot to another, materialized from liquid 
+    transfer effects so lineage can be walked with a recursive query
+    """
+    
+    source_aliquot = models.ForeignKey(Aliquot, on_delete=models.CASCADE,
+                                       related_name='lineage_edges_out',
+                                       related_query_name='lineage_edge_out',
+                                       db_constraint=True)
+    
+    destination_aliquot = models.ForeignKey(Aliquot, on_delete=models.CASCADE,
+                                            related_name='lineage_edges_in',
+                                            related_query_name='lineage_edge_in',
+                                            db_constraint=True)
+    
+    instruction = models.ForeignKey(Instruction, on_delete=models.CASCADE,
+                                    related_name='lineage_edges',
+                                    related_query_name='lineage_edge',
+                                    db_constraint=True)
+    
+    volume_ul = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    #the column walked towards and the one joined on for each direction
+    DIRECTION_COLUMNS = {
+        'ancestors': ('source_aliquot_id', 'destination_aliquot_id'),
+        'descendants': ('destination_aliquot_id', 'source_aliquot_id')
+    }
+    
+    @classmethod
+    def get_lineage(cls, aliquot_ids, direction='ancestors', max_depth=10):
+        """
+        Returns ({aliquot id: depth}, edges) for every aliquot reachable from aliquot_ids
+        within max_depth transfers, walking to sources (ancestors) or destinations 
+        (descendants). Depth is the shortest number of transfers away.
+        """
+        
+        next_column, joined_column = cls.DIRECTION_COLUMNS[direction]
+        
+        aliquot_ids = list(aliquot_ids)
+        
+        if not aliquot_ids or max_depth < 1:
+            return {}, []
+        
+        sql = """
+            WITH RECURSIVE lineage(aliquot_id, depth) AS (
+                SELECT {next_column}, 1 FROM {table} 
+                WHERE {joined_column} = ANY(%s)
+              UNION
+                SELECT edge.{next_column}, lineage.depth + 1 FROM {table} edge
+                JOIN lineage ON edge.{joined_column} = lineage.aliquot_id
+                WHERE lineage.depth < %s
+            )
+            SELECT aliquot_id, MIN(depth) FROM lineage GROUP BY aliquot_id
+        """.format(table=connection.ops.quote_name(cls._meta.db_table),
+                   next_column=next_column,
+                   joined_column=joined_column)
+        
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [aliquot_ids, max_depth])
+            depths = dict(cursor.fetchall())
+            
+        #the start aliquots are depth 0 even if reachable from each other
+        for aliquot_id in aliquot_ids:
+            depths[aliquot_id] = 0
+        
+        edges = cls.objects.filter(source_aliquot_id__in=list(depths.keys()),
+                                   destination_aliquot_id__in=list(depths.keys()))
+        
+        return depths, edges
+    
+    def __str__(self):
+        return 'Aliquot Lineage Edge %s'%self.id
+
 @python_2_unicode_compatible
 class Resource(models.Model):
     name = models.CharField(max_length=200,blank=True,
@@ -725,6 +1629,11 @@ class Resource(models.Model):
     def __str__(self):
         return self.name if self.name else 'Resource %s'%self.id
     
+    @classmethod
+    def get_ids_by_transcriptic_id(cls, transcriptic_ids):
+        return dict(cls.objects.filter(transcriptic_id__in=transcriptic_ids)\
+                    .values_list('transcriptic_id','id'))
+    
     def save(self, *args, **kwargs):
         
         if self.transcriptic_id == '':
@@ -755,4 +1664,73 @@ class Resource(models.Model):
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
-        Token.objects.create(user=instance)
\ No newline at end of file
+        Token.objects.create(user=instance)
+
+
+# Container summary maintenance for edits made outside the interpreter
+
+@receiver(post_save, sender=Container)
+def create_container_summary(sender, instance, created=False, **kwargs):
+    if created:
+        ContainerSummary.objects.create(container=instance)
+        
+@receiver(post_save, sender=Aliquot)
+def update_container_summary(sender, instance, created=False, update_fields=None, **kwargs):
+    
+    #the interpreter updates volumes itself and only saves other fields
+    if update_fields is not None and 'volume_ul' not in update_fields:
+        return
+    
+    #new empty wells don't change anything
+    if created and not Decimal(instance.volume_ul or 0):
+        return
+    
+    ContainerSummary.refresh_volumes([instance.container_id])
+    
+@receiver(post_delete, sender=Aliquot)
+def delete_container_summary_aliquot(sender, instance, **kwargs):
+    #doesn't create summaries, the container may be being deleted too
+    ContainerSummary.refresh_volumes([instance.container_id])
+    
+
+@receiver(post_save, sender=Data)
+def ingest_data_plate_reading(sender, instance, **kwargs):
+    if instance.data_type in PLATE_READING_DATA_TYPES:
+        PlateReading.ingest(instance)
+
+@receiver(post_save, sender=Data)
+def generate_data_image_pyramid(sender, instance, **kwargs):
+    storage = sender._meta.get_field('image').storage
+    
+    #legacy images in the db get thumbnails once moved to blob storage
+    if not instance.image or not hasattr(storage, 'derived_path') \
+       or storage.is_legacy_name(instance.image.name) \
+       or has_image_pyramid(storage, instance.image.name):
+        return
+    
+    name = instance.image.name
+    
+    transaction.on_commit(lambda: generate_image_pyramid_in_background(storage, name))
+
+# Organization membership cache invalidation
+
+@receiver(m2m_changed, sender=Organization.users.through)
+def clear_organization_membership_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    
+    if action not in ['post_add','post_remove','pre_clear']:
+        return
+    
+    #instance is a User when the relation is edited from the user side
+    if reverse:
+        Organization.clear_membership_cache([instance.id])
+    elif action == 'pre_clear':
+        Organization.clear_membership_cache(instance.users.values_list('id',flat=True))
+    else:
+        Organization.clear_membership_cache(pk_set)
+        
+@receiver(post_save, sender=Organization)
+@receiver(pre_delete, sender=Organization)
+def clear_organization_members_cache(sender, instance, **kwargs):
+    if instance.id is None:
+        return
+    Organization.clear_membership_cache(instance.users.values_list('id',flat=True))
@@ -1,9 +1,9 @@
 from django.contrib.auth.models import User, Group
-from models import Run, Organization, Project
+from models import Run, Organization, Project, Container, Aliquot, ContainerSummary
 from rest_framework import serializers
 from rest_framework.response import Response
 
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -18,10 +18,49 @@ class GroupSerializer(serializers.ModelSerializer):
         fields = ('url', 'name')
         
     
-class RunSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Takes an optional `fields` argument that limits which fields are output
+    """
+    
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        
+        super(DynamicFieldsModelSerializer, self).__init__(*args, **kwargs)
+        
+        if fields is not None:
+            for field_name in set(self.fields.keys()) - set(fields):
+                self.fields.pop(field_name)
+    
+class RunSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Run
-        fields = ('id','url', 'title', 'owner','project','protocol')
+        fields = ('id','url', 'title', 'status', 'owner','project',
+                  'created_at', 'completed_at', 'protocol')
+        read_only_fields = ('status', 'completed_at')
+        #left out of lists unless asked for with ?include=
+        list_excluded_fields = ('protocol',)
+        
+class ContainerSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ContainerSummary
+        fields = ('filled_well_count', 'total_volume_ul', 'last_run', 'last_touched_at')
+
+class ContainerSerializer(serializers.ModelSerializer):
+    summary = ContainerSummarySerializer(read_only=True)
+    
+    class Meta:
+        model = Container
+        fields = ('id', 'url', 'label', 'container_type_id', 'barcode', 'cover',
+                  'test_mode', 'storage_condition', 'status', 'expires_at',
+                  'properties', 'generated_by_run', 'organization', 'created_at',
+                  'summary')
+        
+class AliquotSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Aliquot
+        fields = ('id', 'url', 'name', 'container', 'well_idx', 'volume_ul',
+                  'properties', 'created_at')
         
 class OrganizationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -41,4 +80,43 @@ class PageNumberPaginationDataOnly(PageNumberPagination):
     # Set any other options you want here like page_size
 
     def get_paginated_response(self, data):
-        return Response(data)
\ No newline at end of file
+        return Response(data)
+        
+        
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (created_at, id). Pages are found by an indexed range
+    query instead of an OFFSET scan and no COUNT(*) is needed.
+    """
+    ordering = ('created_at', 'id')
+    
+    def get_ordering(self, request, queryset, view):
+        """
+        Views can order by other unique, indexed keys with get_cursor_ordering
+        """
+        
+        if view is not None and hasattr(view, 'get_cursor_ordering'):
+            ordering = view.get_cursor_ordering()
+            if ordering:
+                return ordering
+            
+        return super(CreatedAtCursorPagination, self).get_ordering(request, queryset, view)
+    
+    
+class CursorPaginationDataOnly(CreatedAtCursorPagination):
+    """
+    Returns just the data like PageNumberPaginationDataOnly, the next/previous
+    cursors are sent in the Link header
+    """
+
+    def get_paginated_response(self, data):
+        links = []
+        
+        for rel, link in [('next', self.get_next_link()),
+                          ('prev', self.get_previous_link())]:
+            if link:
+                links.append('<%s>; rel="%s"'%(link, rel))
+                
+        headers = {'Link': ', '.join(links)} if links else None
+        
+        return Response(data, headers=headers)
@@ -0,0 +1,11 @@
+from transcriptic_tools.custom_protocol import CustomProtocol
+
+
+class ProtocolWithoutInventory(CustomProtocol):
+    """
+    CustomProtocol without our reagent inventory, for tests that don't provision reagents
+    """
+
+    def set_test_mode(self, test_mode_on):
+        self.is_test_mode = test_mode_on
+        self.our_inventory = {}
@@ -0,0 +1,49 @@
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework import exceptions
+from autolims.authentication import TokenAuthentication, token_user_cache
+from autolims.models import User
+
+
+class TokenAuthenticationTestCase(TestCase):
+    
+    def setUp(self):
+        token_user_cache.clear()
+        
+        self.user = User.objects.create_user('token user', 
+                                             email='test@test.com',
+                                             password='top_secret')
+        
+        #created by the create_auth_token signal
+        self.token = Token.objects.get(user=self.user)
+        
+    def test_credentials_are_cached(self):
+        
+        with self.assertNumQueries(1):
+            user, token = TokenAuthentication().authenticate_credentials(self.token.key)
+            
+        self.assertEqual(user, self.user)
+            
+        with self.assertNumQueries(0):
+            user, token = TokenAuthentication().authenticate_credentials(self.token.key)
+            
+        self.assertEqual(user, self.user)
+        
+    def test_deleted_token_is_invalidated(self):
+        
+        TokenAuthentication().authenticate_credentials(self.token.key)
+        
+        self.token.delete()
+        
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            TokenAuthentication().authenticate_credentials(self.token.key)
+            
+    def test_deactivated_user_is_invalidated(self):
+        
+        TokenAuthentication().authenticate_credentials(self.token.key)
+        
+        self.user.is_active = False
+        self.user.save()
+        
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            TokenAuthentication().authenticate_credentials(self.token.key)
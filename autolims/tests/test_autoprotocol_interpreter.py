@@ -5,8 +5,10 @@ from decimal import Decimal
 from autolims.autoprotocol_interpreter import execute_run
 from autolims.models import (Organization, Project, Run,
                              Container,
-                             User, Aliquot
+                             User, Aliquot, ContainerSummary,
+                             ContainerSnapshot, AliquotLineageEdge
                              )
+from django.utils import timezone
 from transcriptic_tools.enums import Temperature
 
 class AutoprotocolInterpreterTestCase(TestCase):
@@ -160,6 +162,17 @@ class AutoprotocolInterpreterTestCase(TestCase):
         
         self.assertTrue(all([container.status=='destroyed' for container in destroyed_containers]))
         
+        #volumes can be replayed from before the run and up to now
+        
+        snapshot, aliquots = ContainerSnapshot.get_state(existing_container.id, before_run_id=run.id)
+        
+        self.assertTrue(snapshot)
+        self.assertEqual(aliquots[0]['volume_ul'], Decimal('115'))
+        
+        snapshot, aliquots = ContainerSnapshot.get_state(existing_container.id, at=timezone.now())
+        
+        self.assertEqual(aliquots[0]['volume_ul'], Decimal('40.12'))
+        
         
     def test_pipette_operations(self):
     
@@ -188,5 +201,84 @@ class AutoprotocolInterpreterTestCase(TestCase):
         for aq in test_plate.aliquots.all():
             assert isinstance(aq, Aliquot)
             self.assertEqual(Decimal(aq.volume_ul),volumes[aq.well_idx])
+            
+        #the container summary is kept in step with the aliquots
+        summary = ContainerSummary.objects.get(container=test_plate)
+        
+        self.assertEqual(summary.filled_well_count,5)
+        self.assertEqual(summary.total_volume_ul,sum(volumes))
+        self.assertEqual(summary.last_run_id,run.id)
+        self.assertTrue(summary.last_touched_at)
+        
+        #transfers are recorded as lineage edges
+        aliquot_ids = dict(test_plate.aliquots.values_list('well_idx','id'))
+        
+        depths, edges = AliquotLineageEdge.get_lineage([aliquot_ids[4]], 'ancestors', 1)
+        
+        self.assertDictEqual(depths, {aliquot_ids[4]:0, aliquot_ids[0]:1, aliquot_ids[1]:1})
+        self.assertEqual(edges.count(),3)
+        
+        depths, edges = AliquotLineageEdge.get_lineage([aliquot_ids[0]], 'descendants', 5)
+        
+        self.assertDictEqual(depths, {aliquot_ids[0]:0, aliquot_ids[1]:1, aliquot_ids[2]:1,
+                                      aliquot_ids[3]:1, aliquot_ids[4]:1})
+        
+        #rebuilding from scratch gives the same totals
+        ContainerSummary.rebuild([test_plate.id])
+        
+        summary = ContainerSummary.objects.get(container=test_plate)
+        
+        self.assertEqual(summary.filled_well_count,5)
+        self.assertEqual(summary.total_volume_ul,sum(volumes))
+            
+    def test_add_volumes(self):
+        
+        container = Container.objects.create(container_type_id = '96-pcr',
+                                             label = 'volume plate',
+                                             test_mode = False,
+                                             status = 'available',
+                                             organization = self.org
+                                             )
+        
+        aliquots = [Aliquot.objects.create(container = container,
+                                           well_idx = well_idx,
+                                           volume_ul = "10") for well_idx in range(3)]
+        
+        #aliquots sharing a delta are updated together
+        with self.assertNumQueries(2):
+            Aliquot.add_volumes({aliquots[0].id: Aliquot.get_volume_delta_ul('5:microliter'),
+                                 aliquots[1].id: Aliquot.get_volume_delta_ul(5),
+                                 aliquots[2].id: -Aliquot.get_volume_delta_ul('1500:nanoliter')})
+            
+        volumes = [Decimal('15'),Decimal('15'),Decimal('8.5')]
+            
+        for aq in container.aliquots.all():
+            self.assertEqual(Decimal(aq.volume_ul),volumes[aq.well_idx])
+
+    def test_get_or_create_many(self):
+        
+        container = Container.objects.create(container_type_id = '96-pcr',
+                                             label = 'upsert plate',
+                                             test_mode = False,
+                                             status = 'available',
+                                             organization = self.org
+                                             )
+        
+        existing_aq = Aliquot.objects.create(container = container,
+                                             well_idx = 0,
+                                             volume_ul = "10")
+        
+        #one query to read existing wells and one to insert the missing ones
+        with self.assertNumQueries(2):
+            aliquots_by_well_idx = Aliquot.get_or_create_many(container.id, [0, 1, 2])
+            
+        self.assertEqual(aliquots_by_well_idx[0].id, existing_aq.id)
+        self.assertEqual(aliquots_by_well_idx[1].volume_ul, '0')
+        self.assertEqual(aliquots_by_well_idx[2].properties, {})
         
-    
\ No newline at end of file
+        #existing wells aren't created again
+        with self.assertNumQueries(1):
+            aliquot = Aliquot.get_or_create_by_well_idx(container.id, 2)
+            
+        self.assertEqual(aliquot.id, aliquots_by_well_idx[2].id)
+        self.assertEqual(container.aliquots.count(), 3)
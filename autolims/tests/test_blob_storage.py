@@ -0,0 +1,94 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+from autolims.blob_storage import ChunkedFileStorage
+from autolims.image_pyramid import generate_image_pyramid, has_image_pyramid
+from autolims.models import Data
+
+
+class ChunkedFileStorageTestCase(SimpleTestCase):
+    
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = ChunkedFileStorage(location=self.location, chunk_size=10)
+        self.data = b''.join(chr(i) for i in range(95))
+        
+    def tearDown(self):
+        shutil.rmtree(self.location)
+        
+    def test_save_and_open(self):
+        
+        name = self.storage.save('plate_reader.csv', ContentFile(self.data))
+        
+        self.assertTrue(name.endswith('/plate_reader.csv'))
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.size(name), 95)
+        
+        blob_file = self.storage.open(name)
+        blob_file.seek(13)
+        
+        #reads span chunk boundaries
+        self.assertEqual(blob_file.read(30), self.data[13:43])
+        self.assertEqual(blob_file.read(), self.data[43:])
+        
+        self.assertEqual(b''.join(self.storage.open_blob(name).iter_range(5, 77)), self.data[5:77])
+        
+    def test_deduplication(self):
+        
+        name = self.storage.save('a.bin', ContentFile(self.data))
+        other_name = self.storage.save('b.bin', ContentFile(self.data))
+        
+        self.assertEqual(self.storage.get_content_hash(name), 
+                         self.storage.get_content_hash(other_name))
+        
+        #chunks are removed once no manifest uses them
+        self.assertEqual(self.storage.delete_unreferenced_chunks(), 0)
+        
+        self.storage.delete(name)
+        
+        self.assertFalse(self.storage.exists(other_name))
+        self.assertEqual(self.storage.delete_unreferenced_chunks(), 10)
+        
+    def test_legacy_names(self):
+        
+        self.assertTrue(self.storage.is_legacy_name('autolims.DataFile/bytes/filename/mimetype/a.csv'))
+        self.assertFalse(self.storage.is_legacy_name('%s/a.csv'%('0'*64)))
+        
+    def test_image_pyramid(self):
+        
+        image_buffer = io.BytesIO()
+        Image.new('RGB', (1000, 600)).save(image_buffer, 'PNG')
+        
+        name = self.storage.save('plate.png', ContentFile(image_buffer.getvalue()))
+        
+        self.assertFalse(has_image_pyramid(self.storage, name))
+        
+        with self.settings(IMAGE_TILE_SIZE=256, IMAGE_THUMBNAIL_SIZE=128):
+            generate_image_pyramid(self.storage, name)
+        
+        with open(self.storage.derived_path(name, 'info.json')) as info_file:
+            info = json.load(info_file)
+            
+        #halved until the image fits in one tile
+        self.assertEqual([(level['columns'], level['rows']) for level in info['levels']],
+                         [(4, 3), (2, 2), (1, 1)])
+        
+        self.assertEqual(max(Image.open(self.storage.derived_path(name, 'thumbnail.jpg')).size), 128)
+        self.assertEqual(Image.open(self.storage.derived_path(name, 'tiles', '0', '3_2.jpg')).size, (232, 88))
+        self.assertTrue(os.path.exists(self.storage.derived_path(name, 'tiles', '2', '0_0.jpg')))
+        
+    def test_image_thumbnail_url(self):
+        
+        name = '%s/plate.png'%('0'*64)
+        
+        self.assertEqual(Data(image=name).image_thumbnail_url,
+                         '/files/images/%s/thumbnail.jpg'%name)
+        self.assertIsNone(Data(image='autolims.DataFile/bytes/filename/mimetype/a.png')\
+                          .image_thumbnail_url)
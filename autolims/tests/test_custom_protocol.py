@@ -0,0 +1,188 @@
+import io
+import json
+
+from django.test import SimpleTestCase
+from autoprotocol.container import Container
+from autoprotocol.protocol import Ref
+from transcriptic_tools.utils import ul
+from transcriptic_tools.volume_index import get_changed_well_indexes
+from autolims.tests.helpers import ProtocolWithoutInventory
+
+
+class RedundantMixingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.p = ProtocolWithoutInventory()
+        self.source = self.p.ref('source', cont_type='96-deep', discard=True)
+        self.source.well(0).volume = ul(1000)
+        self.plate = self.p.ref('plate', cont_type='96-flat', discard=True)
+
+    def get_transfers(self):
+        return [xfer for instruction in self.p.as_dict(finalize=False)['instructions']
+                for group in instruction['groups']
+                for xfer in group['transfer']]
+
+    def test_repeated_mix_after(self):
+
+        self.p.transfer(self.source.well(0), self.plate.well(0), ul(50), mix_after=True)
+        self.p.transfer(self.source.well(0), self.plate.well(0), ul(50), mix_after=True)
+
+        transfers = self.get_transfers()
+
+        self.assertNotIn('mix_after', transfers[0])
+        self.assertIn('mix_after', transfers[1])
+
+    def test_identical_mix_after(self):
+
+        #the same mix repeated is only kept on the last transfer
+        for i in range(2):
+            self.p.transfer(self.source.well(0), self.plate.well(0), ul(50),
+                            mix_after=True, mix_vol=ul(20))
+
+        transfers = self.get_transfers()
+
+        self.assertListEqual(['mix_after' in xfer for xfer in transfers],
+                             [False, True])
+
+    def test_dest_becomes_source(self):
+
+        #mixing removed before the dest became a source stays removed
+        self.p.transfer(self.source.well(0), self.plate.well(0), ul(50), mix_after=True)
+        self.p.transfer(self.source.well(0), self.plate.well(0), ul(50), mix_after=True)
+        self.p.transfer(self.plate.well(0), self.plate.well(1), ul(50), mix_after=True)
+
+        transfers = self.get_transfers()
+
+        self.assertListEqual(['mix_after' in xfer for xfer in transfers],
+                             [False, True, True])
+
+    def test_repeated_mix_before(self):
+
+        self.p.transfer(self.source.well(0), self.plate.wells(0, 1), ul(50), mix_before=True)
+
+        transfers = self.get_transfers()
+
+        self.assertListEqual(['mix_before' in xfer for xfer in transfers],
+                             [True, False])
+
+
+class RefLookupTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.p = ProtocolWithoutInventory()
+        self.plate = self.p.ref('plate', cont_type='96-flat', discard=True)
+
+    def test_ref_for_container(self):
+
+        self.assertEqual(self.p._ref_for_container(self.plate), 'plate')
+        self.assertEqual(self.p._refify(self.plate.well(1)), 'plate/1')
+
+        self.p.set_container_name(self.plate, 'renamed')
+
+        self.assertEqual(self.p._ref_for_container(self.plate), 'renamed')
+
+    def test_ref_added_without_ref(self):
+
+        self.p.refs['copied'] = Ref('copied', {'new': '96-flat', 'discard': True},
+                                    Container(None, self.plate.container_type))
+
+        self.assertEqual(self.p._ref_for_container(self.p.refs['copied'].container), 'copied')
+
+    def test_local_ref_before_parent(self):
+
+        child = ProtocolWithoutInventory(parent_protocol=self.p)
+        child.refs['copied'] = Ref('copied', {'new': '96-flat', 'discard': True}, self.plate)
+
+        self.assertEqual(child._ref_for_container(self.plate), 'copied')
+
+        del child.refs['copied']
+
+        self.assertEqual(child._ref_for_container(self.plate), 'plate')
+
+
+class StateTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.p = ProtocolWithoutInventory()
+        self.plate = self.p.ref('plate', cont_type='96-flat', discard=True)
+        self.p.assert_valid_state()
+
+    def test_changed_well_checked(self):
+
+        self.plate.well(5).volume = ul(-1)
+
+        with self.assertRaises(Exception):
+            self.p.assert_valid_state()
+
+    def test_checked_wells_forgotten(self):
+
+        self.plate.well(5).volume = ul(10)
+        self.p.assert_valid_state()
+
+        self.assertEqual(get_changed_well_indexes(self.plate), set())
+
+        #only a full check finds wells changed behind the setter's back
+        self.plate.well(6).__dict__['volume'] = ul(-1)
+        self.p.assert_valid_state()
+
+        with self.assertRaises(Exception):
+            self.p.assert_valid_state(full_check=True)
+
+
+class SerializationTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.p = ProtocolWithoutInventory()
+        self.source = self.p.ref('source', cont_type='96-deep', discard=True)
+        self.source.well(0).volume = ul(1000)
+        self.source.well(0).name = 'media'
+        self.frozen = self.p.ref('frozen', cont_type='96-pcr', storage='cold_20')
+
+        self.p.transfer(self.source.well(0), self.frozen.well(0), ul(50))
+
+    def test_as_dict(self):
+
+        protocol = self.p.as_dict(finalize=False)
+
+        self.assertEqual(protocol['refs']['source'], {'new': '96-deep', 'discard': True})
+        self.assertEqual(protocol['refs']['frozen']['store'], {'where': 'cold_20'})
+        self.assertEqual(protocol['outs'], {'source': {'0': {'name': 'media'}}})
+        self.assertEqual(protocol['instructions'][0]['op'], 'pipette')
+
+    def test_write_json(self):
+
+        json_file = io.BytesIO()
+        self.p.write_json(json_file, finalize=False)
+
+        self.assertEqual(json.loads(json_file.getvalue()), self.p.as_dict(finalize=False))
+
+    def test_time_constraints(self):
+
+        #final protocols always have the attribute, it's only output when there are constraints
+        self.p.time_constraints = []
+
+        json_file = io.BytesIO()
+        self.p.write_json(json_file, finalize=False)
+
+        self.assertNotIn('time_constraints', self.p.as_dict(finalize=False))
+        self.assertNotIn('time_constraints', json.loads(json_file.getvalue()))
+
+        time_constraint = {'from': {'instruction_start': 0},
+                           'to': {'instruction_end': 0},
+                           'less_than': '1:minute'}
+        self.p.time_constraints = [time_constraint]
+
+        json_file = io.BytesIO()
+        self.p.write_json(json_file, finalize=False)
+
+        self.assertEqual(self.p.as_dict(finalize=False)['time_constraints'], [time_constraint])
+        self.assertEqual(json.loads(json_file.getvalue())['time_constraints'], [time_constraint])
+
+    def test_freeze_thaw_cycles(self):
+
+        refs, outs = self.p._build_refs_and_outs(count_freeze_thaw=True)
+
+        self.assertEqual(outs['frozen'], {'0': {'properties': {'freeze_thaw_cycles': '0'}}})
+
+        #the well itself isn't changed
+        self.assertEqual(self.frozen.well(0).properties, {})
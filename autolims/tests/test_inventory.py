@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+from transcriptic_tools import inventory_snapshot
+from transcriptic_tools.utils import ul, init_inventory_wells, init_inventory_well
+from transcriptic_tools.volume_index import get_volume_index
+from autolims.tests.helpers import ProtocolWithoutInventory
+
+
+class InventorySnapshotTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.original_cache_dir = inventory_snapshot.INVENTORY_CACHE_DIR
+        inventory_snapshot.INVENTORY_CACHE_DIR = self.cache_dir
+        inventory_snapshot.clear_inventory_cache()
+
+        os.makedirs(os.path.join(self.cache_dir, 'my_org'))
+
+        with open(os.path.join(self.cache_dir, 'my_org', 'ct1.json'), 'w') as cache_file:
+            json.dump({'id': 'ct1', 'aliquots': []}, cache_file)
+
+    def tearDown(self):
+        inventory_snapshot.clear_inventory_cache()
+        inventory_snapshot.INVENTORY_CACHE_DIR = self.original_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+    def test_disk_cache(self):
+
+        container_jsons = inventory_snapshot.get_container_jsons(['ct1', 'ct1'], {}, 'my_org')
+
+        self.assertEqual(container_jsons, {'ct1': {'id': 'ct1', 'aliquots': []}})
+
+        #later lookups come from memory
+        self.assertIs(inventory_snapshot.get_container_json('ct1', {}, 'my_org'),
+                      container_jsons['ct1'])
+
+    def test_clear_inventory_cache(self):
+
+        inventory_snapshot.get_container_json('ct1', {}, 'my_org')
+        inventory_snapshot.clear_inventory_cache('my_org', ['ct1'])
+
+        self.assertEqual(inventory_snapshot._snapshot, {})
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'my_org', 'ct1.json')))
+
+
+class InventoryTestCase(SimpleTestCase):
+
+    container_json = {
+        'label': 'my plate',
+        'cover': None,
+        'aliquots': [{'well_idx': 1, 'name': 'first', 'volume_ul': '20',
+                      'properties': {}},
+                     {'well_idx': 1, 'name': 'second', 'volume_ul': '30',
+                      'properties': {}},
+                     {'well_idx': 2, 'name': None, 'volume_ul': '40.5',
+                      'properties': {'foo': 'bar'}}]
+    }
+
+    def setUp(self):
+        #refs with an id are initialized from the api
+        self.plate = ProtocolWithoutInventory().ref('plate', cont_type='96-flat', discard=True)
+        self.plate.id = 'ct1'
+
+    def test_init_inventory_wells(self):
+
+        init_inventory_wells(self.plate.all_wells(), self.container_json)
+
+        self.assertEqual(self.plate.well(0).volume, ul(0))
+        self.assertEqual(self.plate.well(1).name, 'first')
+        self.assertEqual(self.plate.well(1).volume, ul(20))
+        self.assertEqual(self.plate.well(2).name, 'my plate')
+        self.assertEqual(self.plate.well(2).properties, {'foo': 'bar'})
+        self.assertIsNot(self.plate.well(2).properties,
+                         self.container_json['aliquots'][2]['properties'])
+        self.assertEqual(get_volume_index(self.plate).total_volume(), ul(60.5))
+
+    def test_init_inventory_well(self):
+
+        for well in self.plate.wells(0, 1, 2):
+            init_inventory_well(well, container_json=self.container_json)
+
+        self.assertEqual(self.plate.well(0).volume, ul(0))
+        self.assertEqual(self.plate.well(1).name, 'first')
+        self.assertEqual(self.plate.well(2).volume, ul(40.5))
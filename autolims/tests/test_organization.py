@@ -1,5 +1,5 @@
 from django.test import TestCase
-from autolims.models import Organization
+from autolims.models import Organization, User
 
 class OrganizationTestCase(TestCase):
     def setUp(self):
@@ -10,4 +10,30 @@ class OrganizationTestCase(TestCase):
         org2 = Organization.objects.create(name="test2", subdomain="test2")
         self.assertEqual(org2.name, 'test2')
         
-    
\ No newline at end of file
+    
+
+class OrganizationMembershipCacheTestCase(TestCase):
+    
+    def setUp(self):
+        self.org = Organization.objects.create(name="Org 2", subdomain="my_org")
+        self.user = User.objects.create_user('org 2 user', 
+                                             email='test@test.com',
+                                             password='top_secret')
+        
+    def test_membership_cache_is_invalidated(self):
+        
+        self.assertEqual(Organization.get_user_organizations_by_subdomain(self.user), {})
+        
+        self.org.users.add(self.user)
+        
+        with self.assertNumQueries(1):
+            self.assertListEqual(Organization.get_user_organizations_by_subdomain(self.user).keys(),
+                                 ['my_org'])
+            
+        #cached
+        with self.assertNumQueries(0):
+            Organization.get_user_organizations_by_subdomain(self.user)
+            
+        self.user.organizations.remove(self.org)
+        
+        self.assertEqual(Organization.get_user_organizations_by_subdomain(self.user), {})
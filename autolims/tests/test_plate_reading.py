@@ -0,0 +1,38 @@
+import numpy as np
+
+from django.test import SimpleTestCase
+from autolims.models import PlateReading
+from transcriptic_tools.utils import _CONTAINER_TYPES
+
+
+class PlateReadingTestCase(SimpleTestCase):
+    
+    def make_plate_reading(self, readings_by_well):
+        well_indexes, values = PlateReading.parse_readings(readings_by_well,
+                                                           _CONTAINER_TYPES['96-flat'])
+        
+        return PlateReading(well_count=values.shape[0],
+                            read_count=values.shape[1],
+                            well_indexes_npy=PlateReading._encode_array(well_indexes),
+                            values_npy=PlateReading._encode_array(values))
+        
+    def test_parse_readings(self):
+        
+        plate_reading = self.make_plate_reading({'A1': [0.1, 0.2],
+                                                 'b2': 0.5,
+                                                 'not a well': 1})
+        
+        self.assertListEqual(list(plate_reading.well_indexes), [0, 13])
+        self.assertEqual(plate_reading.values.shape, (2, 2))
+        self.assertTrue(np.isnan(plate_reading.values[1, 1]))
+        
+    def test_stack(self):
+        
+        plate_readings = [self.make_plate_reading({'A1': 0.1, 'H12': 0.3}),
+                          self.make_plate_reading({'A1': [0.2, 0.4]})]
+        
+        measured_at, readings = PlateReading.stack(plate_readings, well_count=96)
+        
+        self.assertEqual(readings.shape, (2, 96))
+        np.testing.assert_allclose(readings[:, 0], [0.1, 0.3])
+        self.assertTrue(np.isnan(readings[1, 95]))
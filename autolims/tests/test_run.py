@@ -3,7 +3,7 @@ import json
 from django.test import TestCase
 from transcriptic_tools.enums import Temperature
 from autolims.models import (Organization, Run, Project, User, 
-                             Container)
+                             Container, BulkCreateError)
 
 
 
@@ -83,5 +83,56 @@ class RunTestCase(TestCase):
     
         self.assertEqual(run.containers.count(),4)
     
+    def test_bulk_create(self):
         
-    
\ No newline at end of file
+        with open(os.path.join(os.path.dirname(__file__),'data','oligosynthesis.json')) as f:
+            protocol = json.loads(f.read())
+            
+        runs = Run.bulk_create([Run(test_mode=False,
+                                    protocol=protocol,
+                                    project = self.project,
+                                    owner=self.user) for i in range(3)])
+        
+        self.assertEqual(len(runs), 3)
+        
+        for run in runs:
+            run = Run.objects.get(id=run.id)
+            self.assertEqual(run.title, 'Run %s'%run.id)
+            self.assertEqual(run.instructions.count(),6)
+            self.assertEqual(run.containers.count(),2)
+            self.assertTrue(all([container.generated_by_run_id == run.id 
+                                 for container in run.containers.all()]))
+            
+    def test_bulk_create_destroyed_container(self):
+        
+        destroyed_container = Container.objects.create(container_type_id = 'micro-1.5',
+                                                       label = 'My Container',
+                                                       test_mode = False,
+                                                       status = 'destroyed',
+                                                       organization = self.org)
+        
+        with open(os.path.join(os.path.dirname(__file__),'data','pellet_bacteria.json')) as f:
+            bad_protocol = json.loads(f.read())
+            
+        bad_protocol['refs']['bacteria_tube']['id'] = destroyed_container.id
+        
+        with open(os.path.join(os.path.dirname(__file__),'data','oligosynthesis.json')) as f:
+            protocol = json.loads(f.read())
+            
+        run_count = Run.objects.count()
+        
+        with self.assertRaises(BulkCreateError) as context:
+            Run.bulk_create([Run(test_mode=False,
+                                 protocol=protocol,
+                                 project = self.project,
+                                 owner=self.user),
+                             Run(test_mode=False,
+                                 protocol=bad_protocol,
+                                 project = self.project,
+                                 owner=self.user)])
+            
+        errors = context.exception.errors
+        
+        self.assertIsNone(errors[0])
+        self.assertIn('Destoryed container', str(errors[1]))
+        self.assertEqual(Run.objects.count(), run_count)
@@ -0,0 +1,179 @@
+import os
+import json
+from decimal import Decimal
+from django.test import TestCase
+from django.utils import timezone
+from autolims.models import (Organization, Run, Project, User, Container,
+                             ContainerSummary, Aliquot, AliquotEffect)
+
+
+class ConditionalGetTestCase(TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        
+        super(ConditionalGetTestCase,cls).setUpClass()
+        
+        cls.org = Organization.objects.create(name="Org 2", subdomain="my_org")
+        cls.project = Project.objects.create(name="Project 1",organization=cls.org)
+        
+        cls.user = User.objects.create_user('org 2 user', 
+                                             email='test@test.com',
+                                             password='top_secret')
+        
+        cls.org.users.add(cls.user)
+        
+        with open(os.path.join(os.path.dirname(__file__),'data','oligosynthesis.json')) as f:
+            protocol = json.loads(f.read())
+    
+        cls.run = Run.objects.create(title='Oligosynthesis Run',
+                                     test_mode=False,
+                                     protocol=protocol,
+                                     project = cls.project,
+                                     owner=cls.user)           
+        
+    def test_run_api_not_modified(self):
+        
+        response = self.client.get('/api/runs/%s/'%self.run.id)
+        self.assertEqual(response.status_code, 200)
+        
+        etag = response['ETag']
+        
+        response = self.client.get('/api/runs/%s/'%self.run.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        self.run.title = 'Renamed Run'
+        self.run.save()
+        
+        response = self.client.get('/api/runs/%s/'%self.run.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        
+    def test_run_page_not_modified(self):
+        
+        self.client.login(username='org 2 user', password='top_secret')
+        
+        response = self.client.get(self.run.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        
+        etag = response['ETag']
+        
+        response = self.client.get(self.run.get_absolute_url(), 
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        #executing instructions doesn't save the run
+        instruction = self.run.instructions.first()
+        instruction.completed_at = timezone.now()
+        instruction.save()
+        
+        response = self.client.get(self.run.get_absolute_url(), 
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        
+    def test_run_list_sparse_fieldsets(self):
+        
+        response = self.client.get('/api/runs/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('protocol', response.data[0])
+        self.assertIn('status', response.data[0])
+        
+        response = self.client.get('/api/runs/?include=protocol')
+        self.assertIn('protocol', response.data[0])
+        
+        response = self.client.get('/api/runs/?fields=id,status')
+        self.assertListEqual(sorted(response.data[0].keys()), ['id', 'status'])
+        
+        #details still include the protocol by default
+        response = self.client.get('/api/runs/%s/'%self.run.id)
+        self.assertIn('protocol', response.data)
+        
+    def test_run_list_not_modified(self):
+        
+        response = self.client.get('/api/runs/')
+        self.assertEqual(response.status_code, 200)
+        
+        etag = response['ETag']
+        
+        response = self.client.get('/api/runs/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        self.run.title = 'Renamed Run'
+        self.run.save()
+        
+        response = self.client.get('/api/runs/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        
+    def test_containers_api_scoped_to_organizations(self):
+        
+        other_org = Organization.objects.create(name="Org 3", subdomain="other_org")
+        
+        container = Container.objects.create(container_type_id='96-pcr',
+                                             label='my plate',
+                                             organization=self.org)
+        other_container = Container.objects.create(container_type_id='96-pcr',
+                                                   label='their plate',
+                                                   organization=other_org)
+        
+        #token authentication asks for credentials
+        response = self.client.get('/api/containers/%s/'%container.id)
+        self.assertEqual(response.status_code, 401)
+        
+        self.client.login(username='org 2 user', password='top_secret')
+        
+        response = self.client.get('/api/containers/%s/'%container.id)
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.get('/api/containers/%s/'%other_container.id)
+        self.assertEqual(response.status_code, 404)
+        
+        response = self.client.get('/api/containers/%s/lineage/'%other_container.id)
+        self.assertEqual(response.status_code, 404)
+        
+    def test_container_summary_changes_etag(self):
+        
+        container = Container.objects.create(container_type_id='96-pcr',
+                                             label='my plate',
+                                             organization=self.org)
+        ContainerSummary.ensure_summaries_exist([container.id])
+        
+        self.client.login(username='org 2 user', password='top_secret')
+        
+        etags = [self.client.get(url)['ETag'] for url in ['/api/containers/%s/'%container.id,
+                                                          '/api/containers/']]
+        
+        #summary updates don't save the container
+        ContainerSummary.add_volumes({container.id: Decimal('10')})
+        
+        for url, etag in zip(['/api/containers/%s/'%container.id, '/api/containers/'], etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+        
+    def test_aliquot_effect_export_bad_datetime(self):
+        
+        self.client.login(username='org 2 user', password='top_secret')
+        
+        response = self.client.get('/api/my_org/aliquot_effects.ndjson?since=2017-13-01T00:00:00')
+        self.assertEqual(response.status_code, 400)
+        
+    def test_aliquot_effect_export(self):
+        
+        container = Container.objects.create(container_type_id='96-pcr',
+                                             label='my plate',
+                                             organization=self.org)
+        aliquot = Aliquot.objects.create(container=container, well_idx=0, volume_ul='10')
+        AliquotEffect.objects.create(aliquot=aliquot, 
+                                     instruction=self.run.instructions.first(),
+                                     volume_delta_ul=Decimal('-5.5'))
+        
+        self.client.login(username='org 2 user', password='top_secret')
+        
+        response = self.client.get('/api/my_org/aliquot_effects.ndjson?container=%s'%container.id)
+        self.assertEqual(response.status_code, 200)
+        
+        aliquot_effects = [json.loads(line) for line in 
+                           ''.join(response.streaming_content).splitlines()]
+        
+        self.assertEqual(len(aliquot_effects), 1)
+        self.assertEqual(aliquot_effects[0]['aliquot_id'], aliquot.id)
+        self.assertEqual(Decimal(aliquot_effects[0]['volume_delta_ul']), Decimal('-5.5'))
@@ -0,0 +1,25 @@
+from django.test import SimpleTestCase
+from autoprotocol import Unit
+from transcriptic_tools.utils import ul, round_volume
+from transcriptic_tools.volume import to_nanoliters, to_microliters
+
+
+class VolumeTestCase(SimpleTestCase):
+
+    def test_to_nanoliters(self):
+
+        self.assertEqual(to_nanoliters(None), 0)
+        self.assertEqual(to_nanoliters(ul(1.2345)), 1235)
+        self.assertEqual(to_nanoliters(Unit(2, 'milliliter')), 2000000)
+        self.assertEqual(to_nanoliters('5:microliter'), 5000)
+        self.assertEqual(to_nanoliters(0.5), 500)
+
+    def test_to_microliters(self):
+
+        self.assertEqual(to_microliters(Unit(1500, 'nanoliter')), 1.5)
+        self.assertEqual(to_microliters(ul(1.23456)), 1.23456)
+
+    def test_round_volume(self):
+
+        self.assertEqual(round_volume(ul(1.23456), 2), ul(1.23))
+        self.assertEqual(ul('1:milliliter'), ul(1000))
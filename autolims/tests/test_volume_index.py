@@ -0,0 +1,143 @@
+from django.test import SimpleTestCase
+from autoprotocol import Unit
+from autoprotocol.container import Container, Well
+from transcriptic_tools.utils import ul, get_volume, total_plate_available_volume
+from transcriptic_tools.volume_index import (get_volume_index, get_changed_well_indexes,
+                                             track_well_volumes, VolumeTrackedWell, FlagTree)
+from autolims.tests.helpers import ProtocolWithoutInventory
+
+
+class VolumeIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.p = ProtocolWithoutInventory()
+        self.plate = self.p.ref('plate', cont_type='96-flat', discard=True)
+
+    def test_well_without_container(self):
+
+        well = Well(None, 0)
+        well.volume = ul(20)
+
+        self.assertEqual(well.volume, ul(20))
+
+    def test_untracked_containers(self):
+
+        #importing transcriptic_tools leaves autoprotocol's wells alone
+        self.assertNotIn('volume', Well.__dict__)
+
+        container = Container(None, self.plate.container_type)
+        container.well(0).volume = ul(10)
+
+        self.assertIs(type(container.well(0)), Well)
+        self.assertEqual(get_volume_index(container).total_volume(), ul(10))
+
+        container.well(0).volume = ul(20)
+
+        self.assertEqual(get_volume_index(container).total_volume(), ul(20))
+
+        track_well_volumes(container)
+
+        self.assertIsInstance(container.well(0), VolumeTrackedWell)
+        self.assertEqual(container.well(0).volume, ul(20))
+        self.assertEqual(get_changed_well_indexes(container), set([0]))
+
+    def test_volumes_are_mirrored(self):
+
+        self.plate.well(0).volume = ul(100)
+
+        volume_index = get_volume_index(self.plate)
+
+        self.assertEqual(volume_index.total_volume(), ul(100))
+
+        self.plate.well(1).volume = ul(50.5)
+        self.plate.well(0).volume = ul(10)
+
+        self.assertEqual(volume_index.total_volume_nl, 60500)
+        self.assertEqual(self.plate.well(1).volume, ul(50.5))
+        self.assertEqual(total_plate_available_volume(self.plate),
+                         ul(340)*96 - ul(60.5))
+
+    def test_changed_wells(self):
+
+        get_changed_well_indexes(self.plate).clear()
+
+        self.plate.well(3).volume = ul(10)
+
+        self.assertEqual(get_changed_well_indexes(self.plate), set([3]))
+
+    def test_next_non_full_well(self):
+
+        self.plate.wells(0, 1).set_volume('340:microliter')
+
+        volume_index = get_volume_index(self.plate)
+
+        self.assertEqual(volume_index.next_non_full_well_index(), 2)
+
+        self.plate.well(0).volume = ul(0)
+
+        self.assertEqual(volume_index.next_non_full_well_index(), 0)
+        self.assertEqual(volume_index.next_non_full_well_index(1), 2)
+
+    def test_usable_wells_skip_drained_wells(self):
+
+        #A1, B1 and A2 are in columns 0, 0 and 1
+        self.plate.wells(0, 12, 1).set_volume('100:microliter')
+
+        volume_index = get_volume_index(self.plate)
+
+        well_indexes = []
+        for well_index in volume_index.iter_usable_well_indexes():
+            well_indexes.append(well_index)
+            self.plate.well(12).volume = ul(0)
+
+        self.assertListEqual(well_indexes, [0, 1])
+
+    def test_transfer_with_mix_after(self):
+
+        source = self.p.ref('source', cont_type='96-deep', discard=True)
+        source.well(0).volume = ul(1000)
+
+        #the mix volume is worked out on a stand-in well
+        self.p.transfer(source.well(0), self.plate.well(0), ul(50), mix_after=True)
+
+        xfer = self.p.instructions[-1].data['groups'][0]['transfer'][0]
+
+        self.assertIn('mix_after', xfer)
+        self.assertEqual(self.plate.well(0).volume, ul(50))
+        self.assertEqual(get_volume_index(source).total_volume(), ul(950))
+
+    def test_distribute_small_volume(self):
+
+        source = self.p.ref('source', cont_type='96-deep', discard=True)
+        source.well(0).volume = ul(1000)
+
+        self.p.distribute(source.well(0), self.plate.wells(0, 1), ul(5))
+
+        self.assertEqual(self.plate.well(1).volume, ul(5))
+        self.assertEqual(source.well(0).volume, Unit(990, 'microliter'))
+
+    def test_flag_tree(self):
+
+        flags = FlagTree([False, True, False, False, True])
+
+        self.assertEqual(flags.next_set(), 1)
+        self.assertEqual(flags.next_set(2), 4)
+
+        flags.set(4, False)
+
+        self.assertIsNone(flags.next_set(2))
+
+    def test_well_arrays(self):
+
+        self.plate.wells(0, 1).set_volume('100:microliter')
+        self.plate.well(2).volume = ul(-1)
+
+        volume_index = get_volume_index(self.plate)
+        dead_volume_nl = volume_index.dead_well_volume_nl
+
+        self.assertEqual(volume_index.get_volume_nl([0, 1, 2]), 199000)
+        self.assertEqual(volume_index.get_aspiratable_volume_nl([0, 1]),
+                         2 * (100000 - dead_volume_nl))
+        self.assertListEqual(list(volume_index.get_invalid_well_indexes([0, 1, 2])), [2])
+        self.assertEqual(get_volume(self.plate.wells(0, 1), aspiratable=True),
+                         ul(2 * (100 - dead_volume_nl / 1000.0)))
@@ -1,4 +1,5 @@
 import datetime
+import json
 import math
 from enum import Enum
 from collections import defaultdict
@@ -21,7 +22,10 @@ from .utils import (ul, get_well_dead_volume,
                                       touchdown_pcr, convert_stamp_shape_to_wells,
                                       convert_mass_to_volume, ug, round_volume,
                                       calculate_dilution_volume, mM, uM, copy_cell_line_name, copy_well_names,
-                                      convert_string_to_unit, get_diluent_volume)
+                                      convert_string_to_unit, get_diluent_volume, get_volume_index,
+                                      get_changed_well_indexes, track_well_volumes,
+                                      tracks_well_volumes, to_nanoliters,
+                                      prefetch_inventory_containers)
 from lib import lists_intersect, get_dict_optional_value, get_melting_temp
 from .enums import Reagent, Antibiotic, Temperature
 from instruction import MiniPrep
@@ -37,6 +41,19 @@ MAX_STAMP_TIP_VOLUME = ul(148)
 
 DEFAULT_TRASH_PLATE_SIZE = '24-deep'
 
+class _TransferBlock(object):
+    """
+    Wells of a block of transfer groups seen so far by _remove_redundant_mixing
+    """
+    
+    def __init__(self):
+        self.sources = set()
+        self.dests = set()
+        self.has_overlap = False
+        #dest -> last transfer of the block mixing it after
+        self.last_mix_after_xfers = {}
+
+
 class CustomProtocol(Protocol):
    
     def __init__(self,parent_protocol=None,
@@ -59,6 +76,14 @@ class CustomProtocol(Protocol):
         self.parent_protocol = parent_protocol
         self._last_incubated = []
         
+        #id(container) -> ref name, for _ref_for_container
+        self._ref_names_by_container_id = {}
+        
+        #pipette groups already checked by _remove_redundant_mixing and the block of transfers they end in
+        self._mixing_groups = None
+        self._mixing_checked_count = 0
+        self._mixing_block = None
+        
         def get_zero():
             return ul(0)
         
@@ -129,25 +154,33 @@ class CustomProtocol(Protocol):
         if space_available(plate, first_well_index) < volume:
             raise Exception('not enough volume available in %s for %s transfer'%(plate,volume))      
         
-        remaining_volume_to_xfer = volume
+        #volumes are worked out in integer nanoliters
+        remaining_nanoliters_to_xfer = to_nanoliters(volume)
         dst_wells = []
         src_wells = []
         xfer_volumes = []
         
-        for dst_well in plate.all_wells():
-            available_volume = space_available(dst_well)
+        #full wells are skipped without comparing their volumes
+        volume_index = get_volume_index(plate)
+        well_index = volume_index.next_non_full_well_index()
+        
+        while well_index is not None:
+            dst_well = plate.well(well_index)
+            available_nanoliters = volume_index.max_well_volume_nl - volume_index.well_volumes_nl[well_index]
             
-            xfer_volume = min(available_volume,remaining_volume_to_xfer)
+            xfer_nanoliters = min(available_nanoliters,remaining_nanoliters_to_xfer)
             
-            if xfer_volume:
+            if xfer_nanoliters:
                 dst_wells.append(dst_well)
                 src_wells.append(src_well)
-                xfer_volumes.append(xfer_volume)
+                xfer_volumes.append(ul(xfer_nanoliters/1000.0))
                 
-                remaining_volume_to_xfer-=xfer_volume
+                remaining_nanoliters_to_xfer-=xfer_nanoliters
             
-            if not remaining_volume_to_xfer:
+            if not remaining_nanoliters_to_xfer:
                 break
+            
+            well_index = volume_index.next_non_full_well_index(well_index+1)
 
             
         self.transfer(src_wells, dst_wells, xfer_volumes,one_tip=one_tip, new_group=new_group,
@@ -202,74 +235,78 @@ class CustomProtocol(Protocol):
         
             del self.refs[old_name]
             self.refs[new_name] = ref
+            self._index_ref(new_name, ref)
 
     #Needed to fix this bug
     #https://github.com/autoprotocol/autoprotocol-python/issues/133    
     #@TODO: make this smart enough to also work if there are Mix, Consolidate, and Distribute steps involved
     #@TODO: also consider distribute, consolidate, and mix in the keys that are present
     def _remove_redundant_mixing(self, pipette_instruction_groups):
-
-        transfer_groups = []
-        all_transfers = True
-        for xfer_group in pipette_instruction_groups:
+        """
+        Drops mixing that is repeated within a block of transfer groups: mix_before
+        of a source that was already mixed and mix_after of a dest that is mixed again
+        later. Distribute and consolidate groups end a block, and a block where a
+        source is also a dest is left as is.
+        
+        Only the groups appended since the last call are checked, the state of the
+        block they extend is kept on the protocol.
+        """
+        
+        if self._mixing_groups is not pipette_instruction_groups:
+            self._mixing_groups = pipette_instruction_groups
+            self._mixing_checked_count = 0
+            self._mixing_block = None
+        
+        new_xfers = []
+        for xfer_group in pipette_instruction_groups[self._mixing_checked_count:]:
             if xfer_group.keys() == ['transfer']:
-                transfer_groups+=xfer_group['transfer']
+                new_xfers+=xfer_group['transfer']
             else:
-                all_transfers = False
-                
-        if not transfer_groups:
-            return 
-        
-        if not all_transfers:
-            #cleanup the transfer operations in blocks to prevent 
-            # distribute and consolidate from causing bad behavior
-            serial_transfer_groups = []
-            for xfer_group in pipette_instruction_groups:
-                if xfer_group.keys() == ['transfer']:
-                    serial_transfer_groups.append(xfer_group)
-                elif serial_transfer_groups:
-                    self._remove_redundant_mixing(serial_transfer_groups)
-                    serial_transfer_groups = []
-            if serial_transfer_groups:
-                self._remove_redundant_mixing(serial_transfer_groups)
-                serial_transfer_groups = []            
+                self._remove_redundant_block_mixing(new_xfers)
+                new_xfers = []
+                self._mixing_block = None
                 
+        self._remove_redundant_block_mixing(new_xfers)
+        self._mixing_checked_count = len(pipette_instruction_groups)
+        
+    def _remove_redundant_block_mixing(self, new_xfers):
+        
+        if not new_xfers:
             return
         
-        #check that sources are always sources and dests are always dests (this means that we don't need to remix)
-        sources = set()
-        dests = set()
-        for xfer in transfer_groups:
-            sources.add(self._refify(xfer['from']))
-            dests.add(self._refify(xfer['to']))
+        block = self._mixing_block
+        if block is None:
+            block = self._mixing_block = _TransferBlock()
             
+        if block.has_overlap:
+            return
+        
+        xfer_keys = [(self._refify(xfer['from']), self._refify(xfer['to'])) for xfer in new_xfers]
+        dests = block.dests | set([dest_key for _, dest_key in xfer_keys])
+        
         #we can't optimize a set of transfer groups if a source becomes a dest or visa versa right now
-        if lists_intersect(sources,dests):
+        if lists_intersect(block.sources | set([source_key for source_key, _ in xfer_keys]), dests):
+            block.has_overlap = True
             return
         
-        #cleanup mix_before
-        dest_source_cache = {}
-        for xfer in transfer_groups:
-            mix_key = self._refify(xfer['from'])
-
-            if mix_key in dest_source_cache and \
+        block.dests = dests
+        
+        for xfer, (source_key, dest_key) in zip(new_xfers, xfer_keys):
+            
+            #cleanup mix_before
+            if source_key in block.sources and \
                'mix_before' in xfer:
                 del xfer['mix_before']
-
-            dest_source_cache[mix_key] = True
-
-        #cleanup mix_after
-        dest_source_cache = {}
-        for xfer in transfer_groups:
-            mix_key = self._refify(xfer['to'])
-
-            if 'mix_after' in xfer:       
-                dest_source_cache[mix_key] = xfer
-
-        for xfer in transfer_groups:
-            if 'mix_after' in xfer and xfer not in dest_source_cache.values() and \
-            ul(xfer['volume']) >= ul(10):
-                del xfer['mix_after']  
+                
+            block.sources.add(source_key)
+            
+            #cleanup mix_after, only the last mix of each dest is kept
+            if 'mix_after' in xfer:
+                last_xfer = block.last_mix_after_xfers.get(dest_key)
+                if last_xfer is not None and ul(last_xfer['volume']) >= ul(10):
+                    del last_xfer['mix_after']
+                    
+                block.last_mix_after_xfers[dest_key] = xfer
         
     def transfer_column(self,source_plate,source_column_index_or_indexes,dest_plate,dest_column_index_or_indexes,volume,
                         mix_before=False, one_tip=False):
@@ -873,25 +910,28 @@ class CustomProtocol(Protocol):
     def _find_well_with_volume(self, plate, volume):
         well_volumes = []
         
-        remaining_volume = volume
+        #volumes are worked out in integer nanoliters
+        remaining_nanoliters = to_nanoliters(volume)
+        dead_nanoliters = to_nanoliters(plate.container_type.dead_volume_ul)
         
-        for well in plate.all_wells(columnwise=True):
+        volume_index = get_volume_index(plate)
+        
+        #we can't draw from a well that is under safe volume, the index only yields wells above it
+        for well_index in volume_index.iter_usable_well_indexes():
+            well = plate.well(well_index)
             assert isinstance(well,Well)
-
-            #we can't draw from a well that is under safe volume
-            if well.volume < get_well_safe_volume(well):
-                continue
             
             #don't bring the well under its dead volume
-            volume_to_take = min(well.volume - get_well_dead_volume(well),remaining_volume)
+            nanoliters_to_take = min(volume_index.well_volumes_nl[well_index] - dead_nanoliters,
+                                     remaining_nanoliters)
             
-            well_volumes.append([well,volume_to_take])
-            remaining_volume-=volume_to_take
+            well_volumes.append([well,ul(nanoliters_to_take/1000.0)])
+            remaining_nanoliters-=nanoliters_to_take
             
-            if not remaining_volume: 
+            if not remaining_nanoliters: 
                 return well_volumes
                 
-        if remaining_volume:
+        if remaining_nanoliters:
             return None
         
         return well_volumes
@@ -1025,6 +1065,8 @@ class CustomProtocol(Protocol):
         
         assert isinstance(ref,Container)
         
+        self._index_ref(name, self.refs[name])
+        
         #this is a new container so we should initialize all well's to 0 volume
         if not id:
             for well in ref.all_wells():
@@ -1037,7 +1079,18 @@ class CustomProtocol(Protocol):
         
         return ref
     
-    def init_all_refs(self):
+    def prefetch_inventory(self, container_ids, refresh=False):
+        """
+        Fetches inventory for containers that are about to be referenced concurrently
+        so ref() initializes them from the snapshot
+        """
+        prefetch_inventory_containers(container_ids, refresh=refresh)
+    
+    def init_all_refs(self, refresh=False):
+        container_ids = [ref.container.id for ref in self.refs.values() if ref.container.id]
+        
+        self.prefetch_inventory(container_ids, refresh=refresh)
+        
         for ref in self.refs.values():
             if ref.container.id:
                 init_inventory_container(ref.container)
@@ -2144,10 +2197,24 @@ class CustomProtocol(Protocol):
         if had_cover and remove_cover:
             self.cover(ref)
         
-    def assert_valid_state(self):
+    def assert_valid_state(self, full_check=False):
+        """
+        Checks that no well has a negative (or unset) volume.
+        Only wells whose volume changed since they were last checked are looked at
+        unless full_check is set (for debugging)
+        """
         for n, ref in self.refs.items():
-            for well in ref.container.all_wells():
-                assert_non_negative_well(well)        
+            changed_well_indexes = get_changed_well_indexes(ref.container)
+            
+            #changes aren't recorded for containers that weren't added through ref()
+            if full_check or not tracks_well_volumes(ref.container):
+                wells = ref.container.all_wells()
+            else:
+                wells = [ref.container.well(well_index) for well_index in sorted(changed_well_indexes)]
+                
+            for well in wells:
+                assert_non_negative_well(well)
+                changed_well_indexes.discard(well.index)
         
         
               
@@ -2177,74 +2244,107 @@ class CustomProtocol(Protocol):
             p, "time_constraints", []) + \
                                     getattr(self, "time_constraints", [])))
         
-        #build outs for each
-        super(CustomProtocol,self).as_dict()
-        super(CustomProtocol,p).as_dict()
-        
-        other_outs = getattr(p, "outs", {})
-        my_outs = getattr(self, "outs", {})
-        
-        other_outs.update(my_outs)        
-
-        if other_outs:
-            setattr(p, "outs", other_outs)    
-        
         #append our refs (except the reagent plates we just provisioned)
+        provisioned_ref_names = set([reagent.name for reagent in self.unprovisioned_stock_reagent_volumes.keys()])
+        
         for ref_name,ref in self.refs.items():
-            if ref_name not in [reagent.name for reagent in self.unprovisioned_stock_reagent_volumes.keys()]:
+            if ref_name not in provisioned_ref_names:
                 p.refs[ref_name] = ref
+                p._index_ref(ref_name, ref)
                 
-        #update refs to have the correct freeze thaw count
+        #outs (including freeze/thaw counts) are built with the refs when serializing
+             
+        return p
+    
+    def _build_refs_and_outs(self, count_freeze_thaw=False):
+        """
         
-        for ref in p.refs.values():
-            new_container = not ref.opts.get('id')
-
+        Updates the store/discard options of each ref and builds the refs and outs
+        (well names and properties) in one pass over the wells.
+        
+        With count_freeze_thaw (final protocols), wells with volume in frozen containers get
+        a freeze_thaw_cycles property, 0 for new containers and one more than before for existing ones
+        
+        """
+        
+        refs = {}
+        outs = {}
+        
+        for ref_name, ref in self.refs.items():
+            container = ref.container
+            
+            # assign any storage or discard condition changes to ref
+            if "store" in ref.opts:
+                ref.opts["store"] = {"where": container.storage}
+            if container.storage is None and "discard" not in ref.opts:
+                ref.opts["discard"] = True
+                del ref.opts["store"]
+            elif container.storage is not None and "discard" in ref.opts:
+                ref.opts["store"] = {"where": container.storage}
+                del ref.opts["discard"]
+                
+            refs[ref_name] = ref.opts
+            
             #freeze/thaw only applies to frozen containers
-            if not ref.opts.get('store') or ref.opts['store'].get('where') not in ['cold_20','cold_80']: continue
+            frozen = count_freeze_thaw and ref.opts.get('store') and \
+                ref.opts['store'].get('where') in ['cold_20','cold_80']
+            new_container = not ref.opts.get('id')
             
-            for well in ref.container.all_wells():
+            for well in container._wells:
+                properties = well.properties
+                
                 #ignore 0 volume wells
-                if not well.volume or well.volume == ul(0): continue
-                freeze_thaw_cycles = 0
-                if 'freeze_thaw_cycles' in well.properties:
-                    freeze_thaw_cycles = int(well.properties['freeze_thaw_cycles'])
-                    
-                if not new_container:
-                    freeze_thaw_cycles+=1
-                else:
-                    well.properties['freeze_thaw_cycles'] = '0'
+                if frozen and well.volume and well.volume != ul(0):
+                    freeze_thaw_cycles = 0
+                    if not new_container:
+                        freeze_thaw_cycles = int(properties.get('freeze_thaw_cycles', 0)) + 1
+                        
+                    properties = dict(properties, freeze_thaw_cycles=str(freeze_thaw_cycles))
+                
+                if not well.name and not properties:
                     continue
                 
-                if not getattr(p,'outs',{}):
-                    p.outs = {}
+                well_out = outs.setdefault(ref_name, {})[str(well.index)] = {}
                 
-                #these lines ensure there is an out
-                if ref.container.name not in p.outs:
-                    p.outs[ref.container.name] = {str(well.index):{'properties':{}}}
-                    
-                if str(well.index) not in p.outs[ref.container.name]:
-                    p.outs[ref.container.name][str(well.index)] = {'properties':{}}
+                if well.name:
+                    well_out['name'] = well.name
+                if properties:
+                    well_out['properties'] = properties
                     
-                if 'properties' not in p.outs[ref.container.name][str(well.index)]:
-                    p.outs[ref.container.name][str(well.index)]['properties'] = {}
-                    
-                p.outs[ref.container.name][str(well.index)]['properties']['freeze_thaw_cycles'] = str(freeze_thaw_cycles)
-                
-                
-            
+        return refs, outs
+    
+    def _get_protocol_to_serialize(self, finalize=True, seal_on_store=True):
+        if finalize:
+            if seal_on_store:
+                self.seal_on_store()
+            p = self._get_final_protocol()
+        else:
+            p = self
             
-                
-                
-             
+        p.assert_valid_state()
+        
         return p
     
+    def _index_ref(self, ref_name, ref):
+        self._ref_names_by_container_id[id(ref.container)] = ref_name
+        
+        #volume indexes and changed well checks rely on the setter of tracked wells
+        track_well_volumes(ref.container)
     
     #We have modified this to look for containers in the parent protocol in case
     #our instrunctions came from it
+    #Refs are found through _ref_names_by_container_id, scanning self.refs is only
+    #a fallback for refs added without ref()
     def _ref_for_container(self, container):
+        ref_name = self._ref_names_by_container_id.get(id(container))
+        
+        if ref_name in self.refs and self.refs[ref_name].container is container:
+            return ref_name
+            
         for k in self.refs:
             v = self.refs[k]
             if v.container is container:
+                self._ref_names_by_container_id[id(container)] = k
                 return k    
             
         if self.parent_protocol:
@@ -2307,15 +2407,48 @@ class CustomProtocol(Protocol):
     
         """
         
-        if finalize:
-            if seal_on_store:
-                self.seal_on_store()
-            p = self._get_final_protocol()
-            return p.as_dict(finalize=False)
+        p = self._get_protocol_to_serialize(finalize, seal_on_store)
         
-        self.assert_valid_state()
+        refs, outs = p._build_refs_and_outs(count_freeze_thaw=finalize)
+        
+        protocol_dict = {'refs': refs,
+                         'instructions': p._refify(p.instructions)}
+        
+        if outs:
+            protocol_dict['outs'] = p._refify(outs)
+            
+        if getattr(p, 'time_constraints', None):
+            protocol_dict['time_constraints'] = p._refify(p.time_constraints)
                 
-        return super(CustomProtocol,self).as_dict()
+        return protocol_dict
+    
+    def write_json(self, file_handle, finalize=True, seal_on_store=True):
+        """
+        Writes the protocol as json to file_handle (same content as as_dict).
+        Instructions are serialized and written one at a time instead of building
+        the whole protocol dict first
+        """
+        
+        p = self._get_protocol_to_serialize(finalize, seal_on_store)
+        
+        refs, outs = p._build_refs_and_outs(count_freeze_thaw=finalize)
+        
+        file_handle.write('{"refs": %s'%json.dumps(refs))
+        
+        if outs:
+            file_handle.write(', "outs": %s'%json.dumps(p._refify(outs)))
+            
+        if getattr(p, 'time_constraints', None):
+            file_handle.write(', "time_constraints": %s'%json.dumps(p._refify(p.time_constraints)))
+        
+        file_handle.write(', "instructions": [')
+        
+        for instruction_index, instruction in enumerate(p.instructions):
+            if instruction_index:
+                file_handle.write(', ')
+            file_handle.write(json.dumps(p._refify(instruction)))
+            
+        file_handle.write(']}')
     
     
     def spin(self, ref, acceleration, duration, flow_direction=None, spin_direction=None):
@@ -3270,6 +3403,8 @@ class CustomProtocol(Protocol):
         else:
             self.refs[name] = Ref(name, {"reserve": kit_id, "discard": discard}, kit_item)
             
+        self._index_ref(name, self.refs[name])
+            
         for well in kit_item.all_wells():
             well.volume = ul(0)
             
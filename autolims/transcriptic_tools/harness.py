@@ -65,6 +65,10 @@ def run(fn, protocol_name=None, seal_after_run=True,
             return
         
         
+        #fetch referenced inventory at once instead of one request per ref
+        protocol.prefetch_inventory([ref['id'] for ref in source.get('refs', {}).values()
+                                     if ref.get('id')])
+        
         # ------End of custom block ------
         
         params = manifest.protocol_info(protocol_name).parse(protocol, source)
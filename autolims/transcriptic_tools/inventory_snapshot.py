@@ -0,0 +1,190 @@
+"""
+Snapshot of Transcriptic inventory (container json with its aliquots) used to
+initialize referenced containers.
+
+Containers are fetched with one shared keep-alive session, many at a time from
+a thread pool, and cached in memory and on disk for INVENTORY_CACHE_TTL_SECONDS.
+Pass refresh=True (or call clear_inventory_cache) to ignore cached copies.
+"""
+
+import errno
+import json
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+INVENTORY_CACHE_DIR = os.environ.get('TRANSCRIPTIC_INVENTORY_CACHE_DIR',
+                                     os.path.join(os.path.expanduser('~'), '.transcriptic_tools',
+                                                  'inventory_cache'))
+
+INVENTORY_CACHE_TTL_SECONDS = int(os.environ.get('TRANSCRIPTIC_INVENTORY_CACHE_TTL_SECONDS', 300))
+
+#containers fetched at the same time (and connections kept open)
+FETCH_THREAD_COUNT = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+#(org_name, container_id) -> (fetched at, container json)
+_snapshot = {}
+
+
+def get_session():
+    """
+    The requests.Session shared by all inventory calls so connections are reused
+    """
+
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_THREAD_COUNT)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+
+    return _session
+
+
+def container_url(org_name, container_id):
+    return 'https://secure.transcriptic.com/{}/samples/{}.json'.format(org_name, container_id)
+
+
+def _cache_path(org_name, container_id):
+    return os.path.join(INVENTORY_CACHE_DIR, org_name, '%s.json'%container_id)
+
+
+def _read_disk_cache(org_name, container_id):
+    path = _cache_path(org_name, container_id)
+
+    try:
+        fetched_at = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    if time.time() - fetched_at > INVENTORY_CACHE_TTL_SECONDS:
+        return None
+
+    try:
+        with open(path) as cache_file:
+            return fetched_at, json.load(cache_file)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_disk_cache(org_name, container_id, container_json):
+    path = _cache_path(org_name, container_id)
+    directory = os.path.dirname(path)
+
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    #write then rename so other processes never read partial files
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(container_json, temp_file)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def get_container_json(container_id, headers, org_name, refresh=False):
+    """
+    The inventory json of a container from the snapshot, fetched if it isn't
+    cached or its copy is older than INVENTORY_CACHE_TTL_SECONDS
+    """
+
+    key = (org_name, container_id)
+
+    if not refresh:
+        cached = _snapshot.get(key) or _read_disk_cache(org_name, container_id)
+
+        if cached and time.time() - cached[0] <= INVENTORY_CACHE_TTL_SECONDS:
+            _snapshot[key] = cached
+            return cached[1]
+
+    response = get_session().get(container_url(org_name, container_id), headers=headers)
+    response.raise_for_status()
+
+    container_json = response.json()
+
+    _snapshot[key] = (time.time(), container_json)
+    _write_disk_cache(org_name, container_id, container_json)
+
+    return container_json
+
+
+def get_container_jsons(container_ids, headers, org_name, refresh=False):
+    """
+    {container id: inventory json} for the containers, fetching those not in the
+    snapshot concurrently
+    """
+
+    container_ids = list(set(container_ids))
+
+    if not container_ids:
+        return {}
+
+    pool = ThreadPool(min(FETCH_THREAD_COUNT, len(container_ids)))
+
+    try:
+        container_jsons = pool.map(lambda container_id: get_container_json(container_id, headers,
+                                                                           org_name, refresh),
+                                   container_ids)
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict(zip(container_ids, container_jsons))
+
+
+def get_aliquots_by_well_idx(container_json):
+    """
+    {well_idx: aliquot json} of a container json
+    """
+
+    aliquots_by_well_idx = {}
+
+    #the first aliquot of a well wins, as when they were searched for in order
+    for aliquot in container_json['aliquots']:
+        aliquots_by_well_idx.setdefault(aliquot['well_idx'], aliquot)
+
+    return aliquots_by_well_idx
+
+
+def clear_inventory_cache(org_name=None, container_ids=None):
+    """
+    Forgets cached inventory (for org_name and container_ids if given) so the
+    next lookups are fetched again
+    """
+
+    for key in list(_snapshot.keys()):
+        if (org_name is None or key[0] == org_name) and \
+           (container_ids is None or key[1] in container_ids):
+            del _snapshot[key]
+
+    if not os.path.isdir(INVENTORY_CACHE_DIR):
+        return
+
+    org_names = [org_name] if org_name else os.listdir(INVENTORY_CACHE_DIR)
+
+    for cached_org_name in org_names:
+        directory = os.path.join(INVENTORY_CACHE_DIR, cached_org_name)
+
+        if not os.path.isdir(directory):
+            continue
+
+        for filename in os.listdir(directory):
+            if container_ids is None or filename[:-len('.json')] in container_ids:
+                os.remove(os.path.join(directory, filename))
@@ -22,6 +22,10 @@ import numpy
 import os
 import requests
 from lib import round_up
+from volume import to_nanoliters, to_microliters, parse_unit
+from inventory_snapshot import get_container_json, get_container_jsons, get_aliquots_by_well_idx
+from volume_index import (get_volume_index, container_max_well_volume, get_changed_well_indexes,
+                          group_wells_by_container, track_well_volumes, tracks_well_volumes)
 from requests.packages.urllib3.exceptions import InsecureRequestWarning, InsecurePlatformWarning, SNIMissingWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 requests.packages.urllib3.disable_warnings(SNIMissingWarning)
@@ -125,11 +129,17 @@ def set_property(wellorcontainer, property_name, value):
     """
     Sets a property on all wells in a container
     """
-    wells = convert_to_wellgroup(wellorcontainer)
-    
     if not isinstance(value, str):
         value = str(value)
     
+    #a container's wells are all Wells, skip building a WellGroup for them
+    if isinstance(wellorcontainer, Container):
+        for well in wellorcontainer._wells:
+            well.properties[property_name] = value
+        return
+    
+    wells = convert_to_wellgroup(wellorcontainer)
+    
     for well in wells:
         assert isinstance(well, Well)
         well.properties[property_name] = value
@@ -142,64 +152,86 @@ def get_cell_line_name(wellorcontainer):
     
     return wells[0].properties['cell_line_name']
 
-def init_inventory_container(container,headers=None, org_name=None):
+def prefetch_inventory_containers(container_ids, headers=None, org_name=None, refresh=False):
+    """
+    Fetches the inventory of the containers concurrently into the inventory snapshot
+    so initializing them doesn't wait on one request at a time
+    """
     
     initialize_config()
     
     headers = headers if headers else TSC_HEADERS
     org_name = org_name if org_name else ORG_NAME
     
-    def _container_url(container_id):
-            return 'https://secure.transcriptic.com/{}/samples/{}.json'.format(org_name, container_id)
-
-    response = requests.get(_container_url(container.id), headers=headers, verify=False)
-    response.raise_for_status()
+    return get_container_jsons(container_ids, headers, org_name, refresh=refresh)
 
-    container_json = response.json()   
+def init_inventory_container(container,headers=None, org_name=None, refresh=False):
+    
+    initialize_config()
+    
+    headers = headers if headers else TSC_HEADERS
+    org_name = org_name if org_name else ORG_NAME
+    
+    container_json = get_container_json(container.id, headers, org_name, refresh=refresh)
     
     container.cover = container_json['cover']
     
-    for well in container.all_wells():
-        init_inventory_well(well,container_json=container_json)
+    init_inventory_wells(container.all_wells(), container_json)
     
+def init_inventory_wells(wells, container_json):
+    """Initialize the wells of one container (set volume etc) from its inventory json"""
+    
+    for well in wells:
+        aliquots_by_well_idx = _get_container_aliquots_by_well_idx(well.container, container_json)
+        _init_inventory_well_from_aliquot(well, aliquots_by_well_idx.get(well.index), container_json)
    
 #@TODO: this needs to be mocked in tests since it hits the transcriptic api
 def init_inventory_well(well, headers=None, org_name=None,container_json=None):
     """Initialize well (set volume etc) for Transcriptic"""
     
-    initialize_config()
-        
-    headers = headers if headers else TSC_HEADERS
-    org_name = org_name if org_name else ORG_NAME    
-    
-    def _container_url(container_id):
-        return 'https://secure.transcriptic.com/{}/samples/{}.json'.format(org_name, container_id)
-
     #only initialize containers that have already been made
     if not well.container.id:
         well.volume = ul(0)
         return
 
-    if container_json:
-        container = container_json
-    else:
-        response = requests.get(_container_url(well.container.id), headers=headers)
-        response.raise_for_status()
-    
-        container = response.json()
+    if not container_json:
+        initialize_config()
+        
+        headers = headers if headers else TSC_HEADERS
+        org_name = org_name if org_name else ORG_NAME
+        
+        container_json = get_container_json(well.container.id, headers, org_name)
+
+    aliquots_by_well_idx = _get_container_aliquots_by_well_idx(well.container, container_json)
 
-    well_data = list(filter(lambda w: w['well_idx'] == well.index,container['aliquots']))
+    return _init_inventory_well_from_aliquot(well, aliquots_by_well_idx.get(well.index), 
+                                             container_json)
+
+def _get_container_aliquots_by_well_idx(container, container_json):
+    """
+    get_aliquots_by_well_idx of the container's inventory json, kept on the container
+    (until another json is used) rather than searching the aliquots for every well
+    """
     
-    #correct the cover status on the container
+    aliquots_json, aliquots_by_well_idx = container.__dict__.get('_aliquots_by_well_idx', 
+                                                                 (None, None))
+    
+    if aliquots_json is not container_json:
+        aliquots_by_well_idx = get_aliquots_by_well_idx(container_json)
+        container.__dict__['_aliquots_by_well_idx'] = (container_json, aliquots_by_well_idx)
+        
+    return aliquots_by_well_idx
+
+def _init_inventory_well_from_aliquot(well, well_data, container):
     
     #they don't return info on empty wells
     if not well_data:
         well.volume = ul(0)
         return
     
-    well_data = well_data[0]
     well.name = "{}".format(well_data['name']) if well_data['name'] is not None else container["label"]
-    well.properties = well_data['properties']
+    #copied so the snapshot isn't changed with the well
+    well.properties = dict(well_data['properties'])
     if well_data.get('resource'):
         well.properties['Resource'] = well_data['resource']['name']
     well.volume = Unit(well_data['volume_ul'], 'microliter')
@@ -245,14 +277,11 @@ def uniquify(s):
     
     
 def total_plate_available_volume(plate, first_well_index=0):
-
-    if not first_well_index:
-        wells = plate.all_wells()
-    else:
-        wells = plate.all_wells()[first_well_index:]
+    """
+    Capacity of the wells from first_well_index on less the volume in the whole plate
     
-    return (sum([get_well_max_volume(well) for well in wells]) -\
-           total_plate_volume(plate)).to('microliter')
+    """
+    return get_volume_index(plate).available_volume(first_well_index)
 
 def total_plate_volume(plate,aspiratable=False):
     """ Deprecated: use get_volume"""
@@ -263,23 +292,54 @@ def floor_volume(volume):
     """
     Return the math.floor of a volume in microliters
     """
-    return ul(math.floor(volume.to('microliter').magnitude))
+    return ul(math.floor(to_microliters(volume)))
 
 def get_volume(entity,aspiratable=False):
     """
     Returns the total volume in the well, wellgroup, container, or list containing any of the previous
     
     """
+    if isinstance(entity, Container) and not aspiratable:
+        return get_volume_index(entity).total_volume()
+    
     wells = convert_to_wellgroup(entity)
     
-    if aspiratable:
-        return sum([max(well.volume - get_well_dead_volume(well),ul(0)) for well in wells]).to('microliter')
-    else:
-        return sum([well.volume for well in wells]).to('microliter')        
+    #summed as integer nanoliters
+    if len(wells)==1:
+        well = wells[0]
+        if aspiratable:
+            return ul(max(get_well_nanoliters(well) - 
+                          to_nanoliters(well.container.container_type.dead_volume_ul),0)/1000.0)
+        return ul(to_nanoliters(well.volume)/1000.0)
+    
+    #vectorized over each container's volume arrays
+    nanoliters = 0
+    for volume_index, well_indexes in group_wells_by_container(wells):
+        if aspiratable:
+            assert_non_negative_wells(volume_index, well_indexes)
+            nanoliters += volume_index.get_aspiratable_volume_nl(well_indexes)
+        else:
+            nanoliters += volume_index.get_volume_nl(well_indexes)
+            
+    return ul(nanoliters/1000.0)
 
 def assert_non_negative_well(well):
-    if well.volume<ul(0):
+    get_well_nanoliters(well)
+    
+def assert_non_negative_wells(volume_index, well_indexes):
+    invalid_well_indexes = volume_index.get_invalid_well_indexes(well_indexes)
+    
+    if len(invalid_well_indexes):
+        assert_non_negative_well(volume_index.container.well(int(invalid_well_indexes[0])))
+    
+def get_well_nanoliters(well):
+    """
+    Integer nanoliters in the well, raises if the volume is negative or unset
+    """
+    if well.volume is None or to_nanoliters(well.volume)<0:
         raise Exception('Well volume can\'t be negative for well %s'%well)
+    
+    return to_nanoliters(well.volume)
 
 def get_well_dead_volume(wellorcontainer):
     
@@ -315,10 +375,7 @@ def get_well_max_volume(wellorcontainer, mammalian_cell_mode=False):
     
     assert_non_negative_well(well)
     
-    if well.container.container_type.shortname == '6-flat':
-        return ul(100)
-    else:
-        return well.container.container_type.well_volume_ul.to('microliter')
+    return container_max_well_volume(well.container)
 
 def space_available(well, first_well_index=0):
     """
@@ -328,7 +385,7 @@ def space_available(well, first_well_index=0):
     if isinstance(well, Container):
         return (total_plate_available_volume(well, first_well_index)).to('microliter')
     
-    return (get_well_max_volume(well) - well.volume).to('microliter')
+    return ul((to_nanoliters(container_max_well_volume(well.container)) - get_well_nanoliters(well))/1000.0)
     
 
 def touchdown_pcr(fromC, toC, durations, stepsize=2, meltC=98, extC=72):
@@ -358,17 +415,17 @@ def expid(val,expt_name=None):
 def ul(microliters):
     """Unicode function name for creating microliter volumes"""
     if isinstance(microliters,str) and ':' in microliters:
-        return Unit(microliters).to('microliter')    
+        return parse_unit(microliters, 'microliter')
     return Unit(microliters,"microliter")
 
 def hours(hours):
     if isinstance(hours,str) and ':' in hours:
-        return Unit(hours).to('hour')
+        return parse_unit(hours, 'hour')
     return Unit(hours,"hour")
 
 def minutes(minutes):
     if isinstance(minutes,str) and ':' in minutes:
-        return Unit(minutes).to('minute')
+        return parse_unit(minutes, 'minute')
     return Unit(minutes,"minute")
 
 def ug(micrograms):
@@ -472,8 +529,10 @@ def assert_valid_volume(wells,exception_info='invalid volume'):
     """
     wells = ensure_list(wells)
     
-    assert all([well.volume >= get_well_dead_volume(well) for well in wells]), exception_info
-    assert all([well.volume <= get_well_max_volume(well) for well in wells]), exception_info
+    #compared as integer nanoliters, vectorized over each container's volume arrays
+    for volume_index, well_indexes in group_wells_by_container(wells):
+        assert_non_negative_wells(volume_index, well_indexes)
+        assert volume_index.all_within_dead_and_max_volume(well_indexes), exception_info
     
 
 def get_column_wells(container, column_index_or_indexes):
@@ -527,14 +586,14 @@ def round_volume(volume, ndigits):
     """
     Converts to microliters and performs rounding
     """
-    return ul(round(volume.to('microliter').magnitude,ndigits))
+    return ul(round(to_microliters(volume),ndigits))
 
 def ceil_volume(volume,ndigits=0):
     """
     Converts to microliters and performs ceil
     """
     
-    magnitude = volume.to('microliter').magnitude
+    magnitude = to_microliters(volume)
     power_multiple = math.pow(10,ndigits)
     return ul(math.ceil(magnitude * int(power_multiple)) / power_multiple)
     
@@ -0,0 +1,85 @@
+"""
+Volumes as plain integer nanoliters for the hot paths of protocol generation.
+
+Building, converting and comparing pint based Units costs microseconds each,
+our helpers do the same math on nanoliter ints and convert back to a Unit
+(microliters) where it leaves them. Volumes finer than a nanoliter are rounded.
+
+There is deliberately no volume value type: Well.volume has to stay a Unit for
+autoprotocol, so a wrapper would only be built and unwrapped again at every
+boundary. Plain ints are cheaper and also fit in the NumPy arrays of the volume index.
+"""
+
+from __future__ import division
+from autoprotocol import Unit
+
+NANOLITERS_PER_UNIT = {
+    'nanoliter': 1,
+    'microliter': 1000,
+    'milliliter': 1000000,
+    'liter': 1000000000,
+}
+
+#parsed units are kept up to this many distinct strings
+MAX_PARSED_UNITS = 10000
+
+_parsed_units = {}
+
+
+def parse_unit(unit_string, to_units=None):
+    """
+    Unit for a "value:unit" string (optionally converted to to_units).
+    Each distinct string is only parsed once
+    """
+
+    key = (unit_string, to_units)
+    unit = _parsed_units.get(key)
+
+    if unit is None:
+        unit = Unit(unit_string)
+        if to_units:
+            unit = unit.to(to_units)
+
+        if len(_parsed_units) >= MAX_PARSED_UNITS:
+            _parsed_units.clear()
+
+        _parsed_units[key] = unit
+
+    return unit
+
+
+def to_nanoliters(volume):
+    """
+    Integer nanoliters of a volume Unit, "value:unit" string or number of microliters.
+    Unset volumes (None) count as empty
+    """
+
+    if volume is None:
+        return 0
+
+    if isinstance(volume, basestring):
+        volume = parse_unit(volume)
+
+    if isinstance(volume, Unit):
+        nanoliters_per_unit = NANOLITERS_PER_UNIT.get(volume.unit)
+
+        if nanoliters_per_unit is None:
+            return int(round(volume.to('nanoliter').magnitude))
+
+        return int(round(volume.magnitude*nanoliters_per_unit))
+
+    return int(round(volume*1000))
+
+
+def to_microliters(volume):
+    """
+    Microliters of a volume Unit as a float, without rounding to nanoliters
+    """
+
+    if volume.unit == 'microliter':
+        return volume.magnitude
+
+    if volume.unit in NANOLITERS_PER_UNIT:
+        return volume.magnitude*NANOLITERS_PER_UNIT[volume.unit]/1000
+
+    return volume.to('microliter').magnitude
@@ -0,0 +1,308 @@
+"""
+Running volume totals per container so plate wide volume and free space queries
+don't re-sum the Unit of every well.
+
+track_well_volumes switches a container's wells to VolumeTrackedWell, whose volume
+setter keeps the container's ContainerVolumeIndex (NumPy arrays of the wells'
+volumes) in step whenever a well's volume is set. Wells keep their Unit volume for
+autoprotocol, the arrays mirror it. Indexes are only built for containers that are
+queried and volumes are kept as integer nanoliters so the running totals don't drift.
+
+The setter also records which wells changed so state checks only revisit those.
+CustomProtocol tracks the containers it references, other containers keep plain
+autoprotocol wells and get a fresh index each time one is asked for.
+"""
+
+import numpy as np
+from autoprotocol import Unit
+from autoprotocol.container import Well
+from volume import to_nanoliters
+
+
+def container_max_well_volume(container):
+    """
+    We don't allow more than 100uL in 6-flat plates to prevent adding too much volume
+    """
+
+    if container.container_type.shortname == '6-flat':
+        return Unit(100, 'microliter')
+
+    return container.container_type.well_volume_ul.to('microliter')
+
+
+class FlagTree(object):
+    """
+    Fenwick tree over a list of 0/1 flags for finding the next set flag in O(log n)
+    """
+
+    def __init__(self, flags):
+        self.size = len(flags)
+        self.flags = [0]*self.size
+        self.tree = [0]*(self.size+1)
+
+        for idx, flag in enumerate(flags):
+            if flag:
+                self.set(idx, True)
+
+    def set(self, idx, flag):
+        delta = int(bool(flag)) - self.flags[idx]
+
+        if not delta:
+            return
+
+        self.flags[idx] += delta
+
+        position = idx + 1
+        while position <= self.size:
+            self.tree[position] += delta
+            position += position & -position
+
+    def count_before(self, idx):
+        """
+        Number of set flags before idx
+        """
+
+        count = 0
+        position = idx
+        while position > 0:
+            count += self.tree[position]
+            position -= position & -position
+
+        return count
+
+    def next_set(self, idx=0):
+        """
+        The first index >= idx with its flag set or None
+        """
+
+        if idx >= self.size:
+            return None
+
+        if self.flags[idx]:
+            return idx
+
+        #find the position where the running count passes the count before idx
+        remaining = self.count_before(idx) + 1
+        position = 0
+        step = 1
+        while step*2 <= self.size:
+            step *= 2
+
+        while step:
+            if position + step <= self.size and self.tree[position + step] < remaining:
+                position += step
+                remaining -= self.tree[position]
+            step //= 2
+
+        return position if position < self.size else None
+
+
+class ContainerVolumeIndex(object):
+    """
+    Array backed volume state of a container: nanoliters of each well (plus whether
+    it was ever set) and the dead, safe and max volume of its wells as NumPy arrays
+    so plate wide checks and sums are vectorized.
+    
+    Also keeps the running total volume, non-full wells and wells at or above their safe
+    volume (usable, in column order)
+    """
+
+    def __init__(self, container):
+        self.container = container
+
+        well_volumes = [well.volume for well in container._wells]
+        well_count = len(well_volumes)
+
+        self.well_volumes_nl = np.array([to_nanoliters(volume) for volume in well_volumes],
+                                        dtype=np.int64)
+        self.unset_wells = np.array([volume is None for volume in well_volumes], dtype=bool)
+
+        #every well of a container has the same type
+        self.max_well_volume_nl = to_nanoliters(container_max_well_volume(container))
+        self.safe_well_volume_nl = to_nanoliters(container.container_type.safe_min_volume_ul)
+        self.dead_well_volume_nl = to_nanoliters(container.container_type.dead_volume_ul)
+        self.max_well_volumes_nl = np.full(well_count, self.max_well_volume_nl, dtype=np.int64)
+        self.dead_well_volumes_nl = np.full(well_count, self.dead_well_volume_nl, dtype=np.int64)
+
+        self.total_volume_nl = int(self.well_volumes_nl.sum())
+        self.non_full_wells = FlagTree(self.well_volumes_nl < self.max_well_volumes_nl)
+
+        #built the first time usable wells are looked for (reagent plates)
+        self.usable_wells = None
+        self.columnwise_well_indexes = None
+        self.columnwise_positions = None
+
+    def set_well_volume(self, well_index, volume):
+        volume_nl = to_nanoliters(volume)
+
+        self.total_volume_nl += volume_nl - int(self.well_volumes_nl[well_index])
+        self.well_volumes_nl[well_index] = volume_nl
+        self.unset_wells[well_index] = volume is None
+        self.non_full_wells.set(well_index, volume_nl < self.max_well_volume_nl)
+
+        if self.usable_wells is not None:
+            self.usable_wells.set(self.columnwise_positions[well_index],
+                                  volume_nl >= self.safe_well_volume_nl)
+
+    def iter_usable_well_indexes(self):
+        """
+        Yields the indexes of wells at or above their safe volume in column order.
+        Wells drained while iterating are skipped
+        """
+
+        if self.usable_wells is None:
+            self.columnwise_well_indexes = [well.index for well in
+                                            self.container.all_wells(columnwise=True)]
+            self.columnwise_positions = [None]*len(self.well_volumes_nl)
+
+            for position, well_index in enumerate(self.columnwise_well_indexes):
+                self.columnwise_positions[well_index] = position
+
+            self.usable_wells = FlagTree(self.well_volumes_nl[self.columnwise_well_indexes] >=
+                                         self.safe_well_volume_nl)
+
+        position = self.usable_wells.next_set(0)
+
+        while position is not None:
+            yield self.columnwise_well_indexes[position]
+            position = self.usable_wells.next_set(position+1)
+
+    def total_volume(self):
+        return Unit(self.total_volume_nl/1000.0, 'microliter')
+
+    def available_volume(self, first_well_index=0):
+        """
+        Capacity of the wells from first_well_index on less the volume of the whole container
+        (same as summing get_well_max_volume and subtracting total_plate_volume)
+        """
+
+        well_count = len(self.well_volumes_nl) - first_well_index
+
+        return Unit((well_count*self.max_well_volume_nl - self.total_volume_nl)/1000.0,
+                    'microliter')
+
+    def next_non_full_well_index(self, first_well_index=0):
+        return self.non_full_wells.next_set(first_well_index)
+
+    def get_invalid_well_indexes(self, well_indexes):
+        """
+        Indexes of the wells with a negative or unset volume
+        """
+
+        invalid_wells = (self.well_volumes_nl[well_indexes] < 0) | self.unset_wells[well_indexes]
+
+        return np.asarray(well_indexes)[invalid_wells]
+
+    def get_volume_nl(self, well_indexes):
+        return int(self.well_volumes_nl[well_indexes].sum())
+
+    def get_aspiratable_volume_nl(self, well_indexes):
+        """
+        Volume above the dead volume of the wells
+        """
+
+        return int(np.maximum(self.well_volumes_nl[well_indexes] -
+                              self.dead_well_volumes_nl[well_indexes], 0).sum())
+
+    def all_within_dead_and_max_volume(self, well_indexes):
+        volumes_nl = self.well_volumes_nl[well_indexes]
+
+        return bool((volumes_nl >= self.dead_well_volumes_nl[well_indexes]).all() and
+                    (volumes_nl <= self.max_well_volumes_nl[well_indexes]).all())
+
+
+def get_volume_index(container):
+    """
+    The container's ContainerVolumeIndex, built the first time it is needed
+    (every time for containers whose well volumes aren't tracked)
+    """
+
+    #nothing would keep the index of an untracked container up to date
+    if not tracks_well_volumes(container):
+        return ContainerVolumeIndex(container)
+
+    volume_index = container.__dict__.get('_volume_index')
+
+    if volume_index is None:
+        volume_index = container._volume_index = ContainerVolumeIndex(container)
+
+    return volume_index
+
+
+def get_changed_well_indexes(container):
+    """
+    Indexes of the container's wells whose volume was set since they were last
+    checked (see CustomProtocol.assert_valid_state). Checkers discard indexes
+    from the set once the well passes
+    """
+
+    return container.__dict__.setdefault('_changed_well_indexes', set())
+
+
+def group_wells_by_container(wells):
+    """
+    Pairs of (ContainerVolumeIndex, array of well indexes) for the wells,
+    in the order each container is first seen
+    """
+
+    well_indexes_by_container_id = {}
+    containers = []
+
+    for well in wells:
+        container_id = id(well.container)
+
+        if container_id not in well_indexes_by_container_id:
+            well_indexes_by_container_id[container_id] = []
+            containers.append(well.container)
+
+        well_indexes_by_container_id[container_id].append(well.index)
+
+    return [(get_volume_index(container),
+             np.array(well_indexes_by_container_id[id(container)], dtype=np.intp))
+            for container in containers]
+
+
+class VolumeTrackedWell(Well):
+    """
+    Well whose volume setter updates its container's volume index and changed wells,
+    see track_well_volumes
+    """
+
+    @property
+    def volume(self):
+        return self.__dict__.get('volume')
+
+    @volume.setter
+    def volume(self, volume):
+        self.__dict__['volume'] = volume
+
+        get_changed_well_indexes(self.container).add(self.index)
+
+        volume_index = self.container.__dict__.get('_volume_index')
+
+        if volume_index is not None:
+            volume_index.set_well_volume(self.index, volume)
+
+
+def track_well_volumes(container):
+    """
+    Switches the container's wells to VolumeTrackedWell so its volume index is kept
+    up to date and volume changes are recorded from now on
+    """
+
+    if tracks_well_volumes(container):
+        return
+
+    #plain wells keep their volume in the same attribute the property reads
+    for well in container._wells:
+        well.__class__ = VolumeTrackedWell
+
+    container._tracks_well_volumes = True
+
+    #volumes set before weren't recorded
+    get_changed_well_indexes(container).update(well.index for well in container._wells
+                                               if well.volume is not None)
+
+
+def tracks_well_volumes(container):
+    return container.__dict__.get('_tracks_well_volumes', False)
@@ -11,14 +11,20 @@ router.register(r'users', views.UserViewSet)
 router.register(r'groups', views.GroupViewSet)
 router.register(r'runs', views.RunViewSet)
 router.register(r'organizations', views.OrganizationViewSet)
+router.register(r'containers', views.ContainerViewSet)
+router.register(r'aliquots', views.AliquotViewSet)
 
 urlpatterns = [
     #----- API -----
     url(r'^api/', include(router.urls)),
+    url(r'^api/(?P<organization_subdomain>[^/]*)/aliquot_effects\.ndjson$', 
+        views.AliquotEffectExportView.as_view(), name='aliquot_effect_export_api'),
     url(r'^api/(?P<organization_subdomain>[^/]*)/?$', 
         views.OrganizationFromNameView.as_view({'get':'get'}), name='organization_from_name_api'),    
     url(r'^api/(?P<organization_subdomain>[^/]*)/(?P<project_id>[0-9]+)/runs/?$', 
         views.ProjectFromOrganizationNameAPIView.as_view({"post":'create'}), name='project_from_organization_name_api'),          
+    url(r'^api/(?P<organization_subdomain>[^/]*)/(?P<project_id>[0-9]+)/runs/bulk/?$', 
+        views.ProjectFromOrganizationNameAPIView.as_view({"post":'bulk_create'}), name='project_from_organization_name_bulk_api'),          
         
     #redirect users that click the api output
     url(r'^api/(?P<organization_subdomain>[^/]*)/(?P<project_id>[0-9]+)/runs/(?P<run_id>[0-9]+)$', 
@@ -27,6 +33,10 @@ urlpatterns = [
     #------Web-------
         
     url(r'^$', views.HomePageView.as_view(), name='home'),
+    url(r'^files/blobs/(?P<name>[0-9a-f]{64}/[^/]+)$', 
+        views.BlobView.as_view(), name='blob'),
+    url(r'^files/images/(?P<name>[0-9a-f]{64}/[^/]+)/(?P<part>thumbnail\.jpg|info\.json|tiles/[0-9]+/[0-9]+_[0-9]+\.jpg)$', 
+        views.ImagePyramidView.as_view(), name='image_pyramid'),
     url(r'^logout/$', logout, {'next_page': '/login/'}),
     url(r'^(?P<organization_subdomain>[^/]*)/projects$', 
         views.ProjectListView.as_view(), name='projects'),
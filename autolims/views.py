@@ -1,9 +1,21 @@
+import hashlib
+import os
+import json
 from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
 
 from django.shortcuts import render, redirect
 from django.contrib.auth.models import User, Group
 
-from django.http import HttpResponse
+from django.http import (HttpResponse, HttpResponseNotModified, StreamingHttpResponse, Http404,
+                         FileResponse)
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db.models import Max, Count, F
+from django.db.models.functions import Coalesce
+from django.utils.cache import patch_cache_control
 from django.views.generic.base import TemplateView, View
 from django.views.generic import ListView
 from django.contrib.auth.decorators import login_required
@@ -14,17 +26,174 @@ from django.views.decorators.http import require_http_methods
 from django.core.urlresolvers import reverse
 
 from autoprotocol_interpreter import execute_run
+from image_pyramid import has_image_pyramid, generate_image_pyramid
 
-from models import Project, Organization, Run, Container
+from models import (Project, Organization, Run, Container, Aliquot, AliquotEffect,
+                    ContainerSnapshot, AliquotLineageEdge, BulkCreateError)
+from helper_funcs import str_respresents_int
 
 #---- import for api ----- 
 from rest_framework import viewsets
+from rest_framework.decorators import detail_route
 import serializers
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.request import Request
 from rest_framework import authentication, permissions
 from django.core.urlresolvers import resolve
 from rest_framework.views import PermissionDenied
+from rest_framework.exceptions import ParseError
+from rest_framework import status
+
+
+# ----------------------------
+# --- Conditional GET --------
+# ----------------------------
+
+def make_etag(*values):
+    return '"%s"'%hashlib.md5(repr(values)).hexdigest()
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    
+    if not if_none_match:
+        return False
+    
+    client_etags = [client_etag.strip() for client_etag in if_none_match.split(',')]
+    
+    return '*' in client_etags or etag in client_etags or 'W/%s'%etag in client_etags
+
+
+class ConditionalGetMixin(object):
+    """
+    Web view mixin that answers GETs with a 304 when If-None-Match matches
+    the etag built from get_etag_values(), without rendering the page.
+    
+    Must come before the authenticating view so self.run etc. are set.
+    """
+    
+    def get_etag_values(self):
+        """
+        Values the page depends on, None to always render it without an etag
+        """
+        
+        return None
+    
+    def get(self, request, *args, **kwargs):
+        
+        etag_values = self.get_etag_values()
+        
+        if etag_values is None:
+            return super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+        
+        #pages also depend on the user and their csrf token
+        etag = make_etag(request.user.id, 
+                         request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+                         *etag_values)
+        
+        #pending flash messages need a fresh render to be shown
+        if etag_matches(request, etag) and not len(messages.get_messages(request)):
+            response = HttpResponseNotModified()
+        else:
+            response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+            
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        
+        return response
+    
+    
+class ConditionalRetrieveMixin(object):
+    """
+    ViewSet mixin that adds ETags to retrieve and list. Matching If-None-Match
+    headers get a 304 before any object is loaded or serialized.
+    
+    The etag is built from etag_aggregates over the queryset being returned so it must
+    cover everything the serializer outputs.
+    """
+    
+    etag_aggregates = {
+        'last_updated_at': Max('updated_at'),
+        'count': Count('id')
+    }
+    
+    def get_etag(self, queryset):
+        return self.make_etag_from_values(queryset.aggregate(**self.etag_aggregates))
+    
+    def get_page_etag(self, page):
+        """
+        The etag of a page that was already loaded, from get_page_etag_values() or
+        by running etag_aggregates over the page's ids if that returns None
+        """
+        
+        values = self.get_page_etag_values(page)
+        
+        if values is None:
+            return self.get_etag(self.get_queryset().filter(id__in=[obj.id for obj in page]))
+        
+        return self.make_etag_from_values(values)
+    
+    def get_page_etag_values(self, page):
+        """
+        etag_aggregates worked out from the loaded objects. Views with other 
+        etag_aggregates override this or have them run in the db.
+        """
+        
+        if self.etag_aggregates is not ConditionalRetrieveMixin.etag_aggregates:
+            return None
+        
+        return {
+            'last_updated_at': max(obj.updated_at for obj in page) if page else None,
+            'count': len(page)
+        }
+    
+    def make_etag_from_values(self, values):
+        if not values['count']:
+            return None
+        
+        #urls in the output depend on the host and the format on the accept header
+        return make_etag(self.request.build_absolute_uri(),
+                         self.request.META.get('HTTP_ACCEPT'),
+                         sorted(values.items()))
+    
+    def get_conditional_response(self, etag, get_response):
+        if etag and etag_matches(self.request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = get_response()
+            
+        if etag and response.status_code in [status.HTTP_200_OK, 
+                                             status.HTTP_304_NOT_MODIFIED]:
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            
+        return response
+    
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        
+        queryset = self.filter_queryset(self.get_queryset())\
+            .filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        
+        return self.get_conditional_response(
+            self.get_etag(queryset),
+            lambda: super(ConditionalRetrieveMixin, self).retrieve(request, *args, **kwargs))
+    
+    def list(self, request, *args, **kwargs):
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        
+        page = self.paginate_queryset(queryset)
+        
+        if page is None:
+            return self.get_conditional_response(
+                self.get_etag(queryset),
+                lambda: super(ConditionalRetrieveMixin, self).list(request, *args, **kwargs))
+        
+        #the page is only paginated (and loaded) once, for the etag and the response
+        return self.get_conditional_response(
+            self.get_page_etag(page),
+            lambda: self.get_paginated_response(self.get_serializer(page, many=True).data))
     
 # ----------------------------
 # ------- Web Views ----------
@@ -42,15 +211,13 @@ class HomePageView(View):
         
         #get the users 
         
-        organization_query = Organization.objects.filter(users=self.request.user)
+        organization = Organization.objects.filter(users=self.request.user).first()
         
-        if not organization_query.exists():
+        if not organization:
             messages.add_message(self.request, messages.WARNING, 
                                  'User doesn\'t have any organizations')
             return redirect('%s?next=%s' % (settings.LOGIN_URL, self.request.path))            
         
-        organization = organization_query.first()
-        
         return redirect(reverse('projects', 
                                 kwargs={'organization_subdomain':organization.subdomain}))
 
@@ -85,15 +252,26 @@ class OrganizationAuthenticatingView(AuthenticatingView):
         
     
     def get_valid_current_org(self):
-        org_query = Organization.objects.filter(subdomain=self.kwargs['organization_subdomain'])
+        """
+        Memberships are cached per user so this usually doesn't hit the db.
+        The result is kept on the view so repeated authenticate calls within
+        the same request are free.
+        """
         
-        if not self.request.user.is_superuser: 
-            org_query = org_query.filter(users=self.request.user)
+        if hasattr(self, '_valid_current_org'):
+            return self._valid_current_org
         
-        if not org_query.exists():
-            return None
+        subdomain = self.kwargs['organization_subdomain']
+        
+        if self.request.user.is_superuser: 
+            organization = Organization.objects.filter(subdomain=subdomain).first()
+        else:
+            organization = Organization.get_user_organizations_by_subdomain(self.request.user)\
+                .get(subdomain)
+        
+        self._valid_current_org = organization
         
-        return org_query.first()
+        return organization
     
     def get_context_data(self, *args, **kwargs):
     
@@ -112,7 +290,7 @@ class ProjectListView(OrganizationAuthenticatingView,ListView):
     
     def get_queryset(self):
         
-        return Project.objects.filter(organization__subdomain=self.kwargs['organization_subdomain'])\
+        return Project.objects.filter(organization=self.organization)\
                .order_by('id')
     
 
@@ -122,18 +300,19 @@ class ProjectAuthenticatingView(OrganizationAuthenticatingView):
         if not super(ProjectAuthenticatingView, self).authenticate(request):
             return False
     
-        project_query = Project.objects.filter(id=self.kwargs['project_id'],
-                                               organization=self.organization)
-    
-    
+        project = Project.objects.filter(id=self.kwargs['project_id'],
+                                         organization=self.organization).first()
     
-        if not project_query.exists():
+        if not project:
             messages.add_message(self.request, messages.WARNING, 
                                  'Invalid project/org combo')
     
             return False
     
-        self.project = project_query.first()
+        #avoid a query when building urls
+        project.organization = self.organization
+    
+        self.project = project
     
         return True
 
@@ -203,28 +382,45 @@ class RunListView(ProjectAuthenticatingView, TemplateView):
 class RunAuthenticatingView(ProjectAuthenticatingView):
     def authenticate(self, request):
     
-        if not super(RunAuthenticatingView, self).authenticate(request):
+        #skip the project level query, the run query below validates the project/org combo too
+        if not super(ProjectAuthenticatingView, self).authenticate(request):
             return False
     
-        run_query = Run.objects.filter(id=self.kwargs['run_id'],
-                                       project=self.project)
-    
-    
+        run = Run.objects.select_related('project')\
+            .filter(id=self.kwargs['run_id'],
+                    project_id=self.kwargs['project_id'],
+                    project__organization=self.organization).first()
     
-        if not run_query.exists():
+        if not run:
             messages.add_message(self.request, messages.WARNING, 
                                  'Invalid run/project combo')
     
             return False
     
-        self.run = run_query.first()
+        #avoid a query when building urls
+        run.project.organization = self.organization
+    
+        self.project = run.project
+        self.run = run
     
         return True    
     
 @method_decorator(login_required, name='dispatch')    
-class RunView(RunAuthenticatingView, TemplateView):
+class RunView(ConditionalGetMixin, RunAuthenticatingView, TemplateView):
     template_name = 'run.html'    
 
+    def get_etag_values(self):
+        #the page also renders the run's instructions and containers, which change
+        #without the run being saved
+        instruction_values = self.run.instructions.aggregate(Max('updated_at'), Count('id'))
+        run_container_values = self.run.run_containers.aggregate(Max('id'), Count('id'),
+                                                                 Max('container__updated_at'))
+        
+        return [self.run.id, self.run.updated_at, self.project.updated_at,
+                instruction_values['updated_at__max'], instruction_values['id__count'],
+                run_container_values['id__max'], run_container_values['id__count'],
+                run_container_values['container__updated_at__max']]
+
     def get_context_data(self, *args, **kwargs):
     
         context_data = super(RunView, self).get_context_data(*args, **kwargs)    
@@ -293,8 +489,33 @@ class ContainerListView(OrganizationAuthenticatingView,ListView):
     
     def get_queryset(self):
         
-        return Container.objects.filter(organization__subdomain=self.kwargs['organization_subdomain'])\
-               .order_by('id')
+        return Container.objects.filter(organization=self.organization)\
+            .select_related('summary')
+    
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Keyset pagination (see CreatedAtCursorPagination), deep pages are as fast as the first
+        """
+        
+        self.paginator = serializers.CreatedAtCursorPagination()
+        self.paginator.page_size = page_size
+        
+        containers = self.paginator.paginate_queryset(queryset, Request(self.request))
+        
+        is_paginated = self.paginator.has_next or self.paginator.has_previous
+        
+        return (self.paginator, None, containers, is_paginated)
+    
+    def get_context_data(self, *args, **kwargs):
+        
+        context_data = super(ContainerListView, self).get_context_data(*args, **kwargs)
+        
+        context_data.update({
+            'next_page_url': self.paginator.get_next_link(),
+            'previous_page_url': self.paginator.get_previous_link()
+        })
+        
+        return context_data
     
     
 class ContainerAuthenticatingView(OrganizationAuthenticatingView):
@@ -303,23 +524,32 @@ class ContainerAuthenticatingView(OrganizationAuthenticatingView):
         if not super(ContainerAuthenticatingView, self).authenticate(request):
             return False
     
-        container_query = Container.objects.filter(id=self.kwargs['container_id'],
-                                             organization__subdomain=self.kwargs['organization_subdomain'])
+        container = Container.objects.filter(id=self.kwargs['container_id'],
+                                             organization=self.organization).first()
     
-        if not container_query.exists():
+        if not container:
             messages.add_message(self.request, messages.WARNING, 
                                  'Invalid contianer/org combo')
     
             return False
     
-        self.container = container_query.first()
+        #avoid a query when building urls
+        container.organization = self.organization
+    
+        self.container = container
     
         return True   
 
 @method_decorator(login_required, name='dispatch')    
-class ContainerView(ContainerAuthenticatingView, TemplateView):
+class ContainerView(ConditionalGetMixin, ContainerAuthenticatingView, TemplateView):
     template_name = 'container.html'    
 
+    def get_etag_values(self):
+        aliquot_values = self.container.aliquots.aggregate(Max('updated_at'), Count('id'))
+        
+        return [self.container.id, self.container.updated_at, 
+                aliquot_values['updated_at__max'], aliquot_values['id__count']]
+
     def get_context_data(self, *args, **kwargs):
     
         context_data = super(ContainerAuthenticatingView, self).get_context_data(*args, **kwargs)    
@@ -360,21 +590,265 @@ class GroupViewSet(viewsets.ModelViewSet):
     queryset = Group.objects.all()
     serializer_class = serializers.GroupSerializer
     
-class RunViewSet(viewsets.ModelViewSet):
+class SparseFieldsetMixin(object):
+    """
+    ViewSet mixin for DynamicFieldsModelSerializer serializers.
+    
+    GETs can limit the output with ?fields=id,title. Lists leave out the
+    serializer's Meta.list_excluded_fields unless they are requested with
+    ?include=protocol (or named in ?fields=), in which case they also
+    aren't loaded from the db.
+    """
+    
+    def get_requested_fields(self):
+        if self.request.method != 'GET':
+            return None
+        
+        serializer_meta = self.get_serializer_class().Meta
+        
+        query_params = self.request.query_params
+        
+        if query_params.get('fields'):
+            fields = query_params['fields'].split(',')
+        else:
+            fields = list(serializer_meta.fields)
+            
+            if self.action == 'list':
+                includes = query_params.get('include','').split(',')
+                fields = [field for field in fields 
+                          if field not in getattr(serializer_meta, 'list_excluded_fields', []) \
+                          or field in includes]
+        
+        return [field for field in serializer_meta.fields if field in fields]
+    
+    def get_serializer(self, *args, **kwargs):
+        kwargs['fields'] = self.get_requested_fields()
+        return super(SparseFieldsetMixin, self).get_serializer(*args, **kwargs)
+    
+    def get_queryset(self):
+        queryset = super(SparseFieldsetMixin, self).get_queryset()
+        
+        fields = self.get_requested_fields()
+        
+        if fields is not None:
+            excluded_fields = getattr(self.get_serializer_class().Meta, 'list_excluded_fields', [])
+            deferred_fields = [field for field in excluded_fields if field not in fields]
+            if deferred_fields:
+                queryset = queryset.defer(*deferred_fields)
+        
+        return queryset
+    
+class RunViewSet(SparseFieldsetMixin, ConditionalRetrieveMixin, viewsets.ModelViewSet):
     queryset = Run.objects.all()
     serializer_class = serializers.RunSerializer
+    pagination_class = serializers.CursorPaginationDataOnly
     
     def dispatch(self, request, *args, **kwargs):
         return super(RunViewSet, self).dispatch(request, *args, **kwargs)
     
+class LineageMixin(object):
+    """
+    Adds lineage/?direction=ancestors|descendants&max_depth=<n> to a viewset, the aliquots
+    liquid was transferred from (or to) and the transfers between them
+    (lineage_aliquot_field is the lookup from the aliquots to the viewset's object)
+    """
+    
+    lineage_aliquot_field = 'id'
+    
+    def get_lineage_aliquot_ids(self, instance):
+        return Aliquot.objects.filter(**{self.lineage_aliquot_field: instance.id})\
+            .values_list('id', flat=True)
+    
+    @detail_route(methods=['get'])
+    def lineage(self, request, pk=None):
+        
+        instance = self.get_object()
+        
+        direction = request.query_params.get('direction', 'ancestors')
+        
+        if direction not in AliquotLineageEdge.DIRECTION_COLUMNS:
+            raise ParseError('direction must be ancestors or descendants')
+        
+        max_depth = request.query_params.get('max_depth', settings.LINEAGE_DEFAULT_DEPTH)
+        
+        if not str_respresents_int(max_depth) or not 1 <= int(max_depth) <= settings.LINEAGE_MAX_DEPTH:
+            raise ParseError('max_depth must be between 1 and %s'%settings.LINEAGE_MAX_DEPTH)
+        
+        depths, edges = AliquotLineageEdge.get_lineage(self.get_lineage_aliquot_ids(instance),
+                                                       direction, int(max_depth))
+        
+        return Response({
+            'direction': direction,
+            'max_depth': int(max_depth),
+            'aliquots': [dict(aliquot, depth=depths[aliquot['id']]) for aliquot in 
+                         Aliquot.objects.filter(id__in=list(depths.keys()))\
+                         .values('id', 'container_id', 'well_idx').order_by('id')],
+            'edges': [{'source': edge['source_aliquot_id'],
+                       'destination': edge['destination_aliquot_id'],
+                       'instruction': edge['instruction_id'],
+                       'volume_ul': str(edge['volume_ul'])}
+                      for edge in edges.values('source_aliquot_id', 'destination_aliquot_id',
+                                               'instruction_id', 'volume_ul').order_by('id')]
+        })
+    
+class OrganizationScopedMixin(object):
+    """
+    ViewSet mixin for authenticated users that only returns objects of the
+    user's organizations (organization_field is the lookup to the organization)
+    """
+    
+    permission_classes = (permissions.IsAuthenticated,)
+    
+    organization_field = 'organization'
+    
+    def get_queryset(self):
+        queryset = super(OrganizationScopedMixin, self).get_queryset()
+        
+        organizations = Organization.get_user_organizations_by_subdomain(self.request.user)
+        
+        return queryset.filter(**{'%s__in'%self.organization_field: 
+                                  [organization.id for organization in organizations.values()]})
+    
+class ContainerViewSet(OrganizationScopedMixin, LineageMixin, ConditionalRetrieveMixin,
+                       viewsets.ReadOnlyModelViewSet):
+    """
+    Containers can be filtered on their summary totals with ?min_filled_wells=, 
+    ?max_filled_wells=, ?min_total_volume_ul= and ?max_total_volume_ul= and sorted 
+    with ?ordering=filled_wells|total_volume|last_touched (prefix - for descending)
+    """
+    
+    queryset = Container.objects.all().select_related('summary')
+    serializer_class = serializers.ContainerSerializer
+    pagination_class = serializers.CursorPaginationDataOnly
+    
+    lineage_aliquot_field = 'container'
+    
+    #summaries are nested in the output
+    etag_aggregates = {
+        'last_updated_at': Max('updated_at'),
+        'count': Count('id'),
+        'summaries_last_updated_at': Max('summary__updated_at')
+    }
+    
+    summary_filters = [('min_filled_wells', 'summary__filled_well_count__gte', int),
+                       ('max_filled_wells', 'summary__filled_well_count__lte', int),
+                       ('min_total_volume_ul', 'summary__total_volume_ul__gte', Decimal),
+                       ('max_total_volume_ul', 'summary__total_volume_ul__lte', Decimal)]
+    
+    summary_orderings = {
+        'filled_wells': 'summary_filled_well_count',
+        'total_volume': 'summary_total_volume_ul',
+        'last_touched': 'summary_last_touched_at'
+    }
+    
+    def get_queryset(self):
+        
+        queryset = super(ContainerViewSet, self).get_queryset()
+        
+        for param, lookup, value_type in self.summary_filters:
+            value = self.request.query_params.get(param)
+            if value:
+                try:
+                    queryset = queryset.filter(**{lookup: value_type(value)})
+                except (ValueError, InvalidOperation):
+                    raise ParseError('%s must be a number'%param)
+                
+        if self.get_cursor_ordering():
+            #cursors need non null keys
+            queryset = queryset.filter(summary__isnull=False)\
+                .annotate(summary_filled_well_count=F('summary__filled_well_count'),
+                          summary_total_volume_ul=F('summary__total_volume_ul'),
+                          summary_last_touched_at=Coalesce('summary__last_touched_at', 'created_at'))
+            
+        return queryset
+    
+    def get_cursor_ordering(self):
+        ordering = self.request.query_params.get('ordering')
+        
+        if not ordering:
+            return None
+        
+        if ordering.lstrip('-') not in self.summary_orderings:
+            raise ParseError('ordering must be one of %s'%', '.join(self.summary_orderings.keys()))
+        
+        direction = '-' if ordering.startswith('-') else ''
+        
+        return (direction + self.summary_orderings[ordering.lstrip('-')], direction + 'id')
+    
+    def get_page_etag_values(self, page):
+        
+        #summaries were loaded with the page
+        summaries = [container.summary for container in page if hasattr(container, 'summary')]
+        
+        return {
+            'last_updated_at': max(container.updated_at for container in page) if page else None,
+            'count': len(page),
+            'summaries_last_updated_at': max(summary.updated_at for summary in summaries)
+                if summaries else None
+        }
+    
+    @detail_route(methods=['get'])
+    def state(self, request, pk=None):
+        """
+        Aliquot volumes at ?at=<ISO 8601 datetime> or just before ?at=<run id> executed,
+        replayed from the nearest earlier snapshot
+        """
+        
+        container = self.get_object()
+        
+        at = request.query_params.get('at')
+        
+        if not at:
+            raise ParseError('at must be an ISO 8601 datetime or a run id')
+        
+        try:
+            if str_respresents_int(at):
+                snapshot, aliquots = ContainerSnapshot.get_state(container.id, before_run_id=int(at))
+            else:
+                at_datetime = parse_datetime(at)
+                if at_datetime is None:
+                    raise ParseError('at must be an ISO 8601 datetime or a run id')
+                if timezone.is_naive(at_datetime):
+                    at_datetime = timezone.make_aware(at_datetime)
+                snapshot, aliquots = ContainerSnapshot.get_state(container.id, at=at_datetime)
+        except ValueError as e:
+            raise ParseError(str(e))
+        
+        return Response({
+            'container': container.id,
+            'at': at,
+            'snapshot': {'id': snapshot.id,
+                         'taken_at': snapshot.taken_at} if snapshot else None,
+            'aliquots': [{'aliquot_id': aliquot['aliquot_id'],
+                          'well_idx': aliquot['well_idx'],
+                          'volume_ul': str(aliquot['volume_ul'])}
+                         for aliquot in aliquots]
+        })
+    
+class AliquotViewSet(OrganizationScopedMixin, LineageMixin, ConditionalRetrieveMixin,
+                     viewsets.ReadOnlyModelViewSet):
+    queryset = Aliquot.objects.all()
+    serializer_class = serializers.AliquotSerializer
+    pagination_class = serializers.CursorPaginationDataOnly
+    
+    organization_field = 'container__organization'
+    
 class ProjectViewSet(viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = serializers.ProjectSerializer
     
-class OrganizationViewSet(viewsets.ModelViewSet):
+class OrganizationViewSet(ConditionalRetrieveMixin, viewsets.ModelViewSet):
     queryset = Organization.objects.all()
     serializer_class = serializers.OrganizationSerializer
     
+    #projects are nested in the output
+    etag_aggregates = {
+        'last_updated_at': Max('updated_at'),
+        'count': Count('id', distinct=True),
+        'projects_last_updated_at': Max('project__updated_at'),
+        'projects_count': Count('project', distinct=True)
+    }
+    
 class OrganizationFromNameView(OrganizationAuthenticatingView,viewsets.GenericViewSet):
     
     def get(self, request, *args, **kwargs):
@@ -402,4 +876,241 @@ class ProjectFromOrganizationNameAPIView(ProjectAuthenticatingView,RunViewSet):
         request._data['owner'] = request.user.id
         
         return super(ProjectFromOrganizationNameAPIView, self).create(request, *args, **kwargs)   
-     
+    
+    def bulk_create(self, request, *args, **kwargs):
+        """
+        Accepts a list of runs for the project. Every run is validated before any are 
+        created, then they are all created in one transaction (see Run.bulk_create).
+        
+        Returns one result per submitted run, in order: the run or its validation errors
+        (including unknown resources and containers the run can't use).
+        """
+        
+        if not self.authenticate(request):
+            project_id = -1
+        else:
+            project_id = self.project.id
+            
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of runs'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        run_serializers = []
+        
+        for run_data in request.data:
+            if isinstance(run_data, dict):
+                run_data = dict(run_data, project=project_id, owner=request.user.id)
+                
+            run_serializer = self.get_serializer(data=run_data)
+            run_serializer.is_valid()
+            run_serializers.append(run_serializer)
+            
+        if any(run_serializer.errors for run_serializer in run_serializers):
+            return Response([{'errors': run_serializer.errors} if run_serializer.errors else None
+                             for run_serializer in run_serializers],
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            runs = Run.bulk_create([Run(**run_serializer.validated_data) 
+                                    for run_serializer in run_serializers])
+        except BulkCreateError as e:
+            return Response([{'errors': {'non_field_errors': [unicode(error)]}} if error else None
+                             for error in e.errors],
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        #the client already has the protocols
+        fields = [field for field in serializers.RunSerializer.Meta.fields
+                  if field not in serializers.RunSerializer.Meta.list_excluded_fields]
+        
+        return Response([serializers.RunSerializer(run, fields=fields,
+                                                   context=self.get_serializer_context()).data
+                         for run in runs],
+                        status=status.HTTP_201_CREATED)
+    
+    
+class AliquotEffectExportView(OrganizationAuthenticatingView, APIView):
+    """
+    Streams the organization's aliquot effects as NDJSON (one json object per line)
+    ordered by id.
+    
+    Optional filters: ?run=<id>, ?container=<id>, ?since=<iso datetime>, ?until=<iso datetime>
+    """
+    
+    batch_size = 2000
+    
+    fields = ('id', 'type', 'data', 'volume_delta_ul', 'created_at', 'aliquot_id', 
+              'aliquot__container_id', 'aliquot__well_idx', 'instruction_id', 
+              'instruction__run_id', 'instruction__sequence_no')
+    
+    def get(self, request, *args, **kwargs):
+        
+        if not self.authenticate(request):
+            raise PermissionDenied('doesn\'t exist or not allowed access to '
+                                   'org with subdomain %s'%self.kwargs['organization_subdomain'])
+        
+        filters = {'aliquot__container__organization': self.organization}
+        
+        for param, lookup in [('run', 'instruction__run_id'),
+                              ('container', 'aliquot__container_id')]:
+            value = request.query_params.get(param)
+            if value:
+                if not str_respresents_int(value):
+                    raise ParseError('%s must be an id'%param)
+                filters[lookup] = int(value)
+                
+        for param, lookup in [('since', 'created_at__gte'),
+                              ('until', 'created_at__lt')]:
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    parsed_value = parse_datetime(value)
+                except ValueError:
+                    #well formatted but out of range, e.g. month 13
+                    parsed_value = None
+                if parsed_value is None:
+                    raise ParseError('%s must be an ISO 8601 datetime'%param)
+                if timezone.is_naive(parsed_value):
+                    parsed_value = timezone.make_aware(parsed_value)
+                filters[lookup] = parsed_value
+        
+        queryset = AliquotEffect.objects.filter(**filters).values(*self.fields)
+        
+        return StreamingHttpResponse(self.stream_ndjson(queryset),
+                                     content_type='application/x-ndjson')
+    
+    def stream_ndjson(self, queryset):
+        """
+        Reads the effects in keyset batches so memory stays constant however many match
+        """
+        
+        last_id = 0
+        
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).order_by('id')[:self.batch_size])
+            
+            if not batch:
+                return
+            
+            for aliquot_effect in batch:
+                yield json.dumps(aliquot_effect, cls=DjangoJSONEncoder) + '\n'
+                
+            last_id = batch[-1]['id']
+
+
+class BlobView(View):
+    """
+    Streams a Data file or image from blob storage. 
+    Supports single byte range requests so large files can be resumed or sampled.
+    """
+    
+    def parse_range(self, range_header, size):
+        """
+        Returns (start, end exclusive) or None to send the whole file.
+        Raises ValueError for ranges outside the file.
+        """
+        
+        if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+            return None
+        
+        start, _, end = range_header[len('bytes='):].strip().partition('-')
+        
+        try:
+            if not start:
+                #suffix range, the last n bytes
+                start, end = max(size - int(end), 0), size
+            else:
+                start, end = int(start), min(int(end) + 1, size) if end else size
+        except ValueError:
+            return None
+        
+        if start >= end:
+            raise ValueError('Range not satisfiable')
+        
+        return start, end
+    
+    def get(self, request, name):
+        
+        if not hasattr(default_storage, 'open_blob') or default_storage.is_legacy_name(name) \
+           or not default_storage.exists(name):
+            raise Http404
+        
+        blob = default_storage.open_blob(name)
+        
+        etag = '"%s"'%default_storage.get_content_hash(name)
+        
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
+        range_header = request.META.get('HTTP_RANGE')
+        
+        #only honour the range if the client has the current version
+        if request.META.get('HTTP_IF_RANGE', etag) != etag:
+            range_header = None
+        
+        try:
+            byte_range = self.parse_range(range_header, blob.size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s'%blob.size
+            return response
+        
+        start, end = byte_range or (0, blob.size)
+        
+        response = StreamingHttpResponse(blob.iter_range(start, end),
+                                         content_type=blob.manifest['mimetype'],
+                                         status=206 if byte_range else 200)
+        
+        if byte_range:
+            response['Content-Range'] = 'bytes %s-%s/%s'%(start, end - 1, blob.size)
+        
+        response['Content-Length'] = end - start
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Content-Disposition'] = 'inline; filename="%s"'%name.split('/', 1)[1].replace('"', '')
+        
+        return response
+
+
+class ImagePyramidView(View):
+    """
+    Serves the thumbnail, zoom tiles or info.json (level dimensions) of a Data image 
+    so viewers fetch only the resolution they display. 
+    Generates them if the background stage hasn't yet.
+    """
+    
+    content_types = {'.jpg': 'image/jpeg',
+                     '.json': 'application/json'}
+    
+    def get(self, request, name, part):
+        
+        if not hasattr(default_storage, 'derived_path') or not default_storage.exists(name):
+            raise Http404
+        
+        #content addressed, so never changes
+        etag = make_etag(name, part)
+        
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
+        if not has_image_pyramid(default_storage, name):
+            try:
+                generate_image_pyramid(default_storage, name)
+            except IOError:
+                raise Http404('Not an image')
+        
+        path = default_storage.derived_path(name, *part.split('/'))
+        
+        if not os.path.exists(path):
+            raise Http404
+        
+        response = FileResponse(open(path, 'rb'),
+                                content_type=self.content_types[os.path.splitext(path)[1]])
+        response['Content-Length'] = os.path.getsize(path)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=365*24*60*60)
+        
+        return response
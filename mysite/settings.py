@@ -54,7 +54,15 @@ INSTALLED_APPS = [
 
 TEMPLATE_DEBUG = True
 
-DEFAULT_FILE_STORAGE = 'db_file_storage.storage.DatabaseFileStorage'
+DEFAULT_FILE_STORAGE = 'autolims.blob_storage.ChunkedFileStorage'
+
+#Data files and images are stored here as content addressed chunks
+BLOB_STORAGE_ROOT = os.environ.get('BLOB_STORAGE_ROOT', os.path.join(BASE_DIR, 'blobs'))
+BLOB_STORAGE_CHUNK_SIZE = 4*1024*1024
+
+#thumbnails and zoom tiles of Data images (pixels)
+IMAGE_THUMBNAIL_SIZE = 256
+IMAGE_TILE_SIZE = 256
 
 
 MIDDLEWARE = [
@@ -157,6 +165,20 @@ USE_L10N = True
 USE_TZ = True
 
 
+#seconds a user's org memberships are cached for when authorizing views
+ORGANIZATION_MEMBERSHIP_CACHE_TIMEOUT = 60
+
+#process local cache of api token -> user (seconds, entries)
+TOKEN_AUTHENTICATION_CACHE_TIMEOUT = 30
+TOKEN_AUTHENTICATION_CACHE_MAX_SIZE = 10000
+
+#effects on a container between automatic snapshots (see ContainerSnapshot)
+CONTAINER_SNAPSHOT_EFFECT_INTERVAL = 200
+
+#transfers walked by lineage queries by default and at most
+LINEAGE_DEFAULT_DEPTH = 10
+LINEAGE_MAX_DEPTH = 50
+
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.